@@ -0,0 +1,230 @@
+import json
+import sys
+import threading
+import time
+import types
+from collections import Counter
+
+INDICES = ['NDVI', 'EVI', 'NDWI1', 'NDWI2', 'NMDI', 'MSI', 'MSAVI2']
+STATISTICS = ['mean', 'median', 'mode']
+
+
+class Backend:
+    # Stands in for the Earth Engine servers: every getInfo/getMapId sleeps for the configured latency
+    # and answers with a payload shaped like the real response
+    def __init__(self, latency=0.05, n_images=12, hist_bins=20, padding=0, n_polygons=10):
+        self.latency = latency
+        self.n_images = n_images
+        self.n_polygons = n_polygons
+        self.hist_bins = hist_bins
+        self.padding = padding
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+    @property
+    def round_trips(self):
+        return sum(self.calls.values())
+
+    def round_trip(self, kind, node):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls[kind] += 1
+        return self.respond(node)
+
+    def dates(self):
+        return [f"{2018 + i // 2}-{'05' if i % 2 == 0 else '08'}-15" for i in range(self.n_images)]
+
+    def respond(self, node):
+        if node.op == 'aggregate_array':
+            return self.dates()
+        if node.op == 'Dictionary' and 'scene' in node.args[0]:
+            return {'scene': [f"S{i}" for i in range(self.n_images)], 'index': [str(i) for i in range(self.n_images)],
+                    'date': self.dates()}
+        if node.op == 'map' and node.args[0].op == 'reduceRegions':
+            features = node.args[0].kwargs['collection'].args[0]
+            return self._pad({'type': 'FeatureCollection', 'features': [
+                {'type': 'Feature', 'geometry': None, 'properties': {
+                    'mine': feature.args[1]['mine'],
+                    **{f"{i}_{index}_{stat}": 0.1 * (i % 5) for i in range(self.n_images)
+                       for index in INDICES for stat in STATISTICS}}} for feature in features]})
+        if node.op == 'map' and node.args[0].op == 'limit':
+            # A page of global_mining_polygons, the count following an id
+            collection, count = node.args[0].args[:2]
+            after = collection.args[1].args[1] if collection.op == 'filter' else None
+            ids = [i for i in range(self.n_polygons) if after is None or f"{i:020x}" > after][:count]
+            return {'type': 'FeatureCollection', 'features': [
+                {'type': 'Feature', 'id': f"{i:020x}", 'properties': {},
+                 'geometry': {'type': 'Polygon', 'coordinates': [[[x, 52.0], [x + 0.05, 52.0], [x + 0.05, 52.03],
+                                                                  [x, 52.0]]]}}
+                for i, x in ((i, 18.0 + 0.1 * i) for i in ids)]}
+        if node.op == 'size':
+            return self.n_polygons
+        if node.op == 'reduceRegion':
+            return self._pad({f"{i}_{index}_{stat}": 0.1 * (i % 5) for i in range(self.n_images)
+                              for index in INDICES for stat in STATISTICS})
+        if node.op == 'Dictionary' and 'mean' in node.args[0]:
+            bands = [f"{i}_{index}" for i in range(self.n_images) for index in INDICES]
+            hists = {}
+            for index in INDICES:
+                low, high, bins = node.args[0][index].kwargs['reducer'].args
+                hists[index] = [[low + k * (high - low) / bins, bins // 2 - abs(k - bins // 2)]
+                                for k in range(bins)]
+            return self._pad({'mean': {band: 0.1 for band in bands},
+                              **{index: {band: hists[index] for band in bands if band.endswith(f"_{index}")}
+                                 for index in INDICES}})
+        if node.op == 'Dictionary' and 'simplified' in node.args[0]:
+            polygon = {'type': 'Polygon', 'coordinates': [[[18.0, 52.0], [18.05, 52.0], [18.05, 52.03], [18.0, 52.03],
+                                                           [18.0, 52.0]]]}
+            return {'geometry': polygon, 'simplified': polygon}
+        if node.op == 'Dictionary':
+            width = 2 / self.hist_bins
+            hist = [[-1 + k * width, k] for k in range(self.hist_bins)]
+            return self._pad({key: hist for key in node.args[0]})
+        if node.op == 'getRegion':
+            return [['id', 'longitude', 'latitude', 'time'] + INDICES] + [
+                [str(i), 18.0, 52.0, None] + [0.1 * (i % 5)] * len(INDICES) for i in range(self.n_images)]
+        if node.op == 'getMapId':
+            return f"https://fake-ee.local/{id(node)}/{{z}}/{{x}}/{{y}}"
+        return None
+
+    def compute_pixels(self, params):
+        import numpy as np
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls['computePixels'] += 1
+        dimensions = params['grid']['dimensions']
+        shape = (dimensions['height'], dimensions['width'])
+        pixels = np.zeros(shape, dtype=[(index, np.float32) for index in INDICES])
+        rng = np.random.default_rng(0)
+        for index in INDICES:
+            pixels[index] = rng.uniform(-1, 1, shape)
+        return pixels
+
+    def _pad(self, payload):
+        if self.padding:
+            payload['_padding'] = 'x' * self.padding
+        return payload
+
+
+backend = Backend()
+
+
+def _resolve(value):
+    # Like ee.CustomFunction, mapped Python functions are traced once with a placeholder argument
+    if callable(value) and not isinstance(value, (Node, Constructor)):
+        return value(Node('variable'))
+    return value
+
+
+def _serialize(value):
+    if isinstance(value, Node):
+        return [value.op, _serialize(value.args), _serialize(value.kwargs)]
+    if isinstance(value, (list, tuple)):
+        return [_serialize(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _serialize(item) for key, item in value.items()}
+    return repr(value)
+
+
+class Node:
+    def __init__(self, op, *args, **kwargs):
+        self.op = op
+        self.args = tuple(_resolve(arg) for arg in args)
+        self.kwargs = {key: _resolve(value) for key, value in kwargs.items()}
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            return Node(name, self, *args, **kwargs)
+        return method
+
+    def serialize(self):
+        return json.dumps(_serialize(self))
+
+    def getInfo(self):
+        return backend.round_trip('getInfo', self)
+
+    def getMapId(self, vis_params=None):
+        url = backend.round_trip('getMapId', Node('getMapId', self, vis_params))
+        return {'mapid': url, 'tile_fetcher': types.SimpleNamespace(url_format=url)}
+
+
+class Constructor:
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        return Node(self.name, *args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return Constructor(f"{self.name}.{name}")
+
+
+def _module_getattr(name):
+    if name.startswith('__'):
+        raise AttributeError(name)
+    return Constructor(name)
+
+
+class EEException(Exception):
+    pass
+
+
+class FakeMap:
+    def __init__(self, **kwargs):
+        self.layers = []
+
+    def add_tile_layer(self, tiles, name=None, **kwargs):
+        self.layers.append(name)
+
+    def addLayer(self, ee_object, vis_params=None, name=None, **kwargs):
+        ee_object.getMapId(vis_params)
+        self.layers.append(name)
+
+    def add_colorbar(self, *args, **kwargs):
+        pass
+
+    def add_layer_control(self, *args, **kwargs):
+        pass
+
+    def to_streamlit(self, *args, **kwargs):
+        pass
+
+
+def install():
+    ee = types.ModuleType('ee')
+    for name in ('Image', 'ImageCollection', 'Feature', 'FeatureCollection', 'Filter', 'Reducer', 'Geometry', 'List',
+                 'Number', 'Date', 'Dictionary', 'String', 'Array', 'Algorithms', 'Kernel'):
+        setattr(ee, name, Constructor(name))
+    ee.Initialize = lambda *args, **kwargs: None
+    ee.Authenticate = lambda *args, **kwargs: None
+    ee.EEException = EEException
+    ee.data = types.SimpleNamespace(setDeadline=lambda *args: None, computePixels=backend.compute_pixels)
+    ee.__getattr__ = _module_getattr
+
+    geemap = types.ModuleType('geemap')
+    foliumap = types.ModuleType('geemap.foliumap')
+    foliumap.Map = FakeMap
+    foliumap.ee_initialize = lambda *args, **kwargs: None
+    coreutils = types.ModuleType('geemap.coreutils')
+    coreutils.check_cmap = lambda name: [name]
+    coreutils.ee_initialize = foliumap.ee_initialize
+    geemap.foliumap = foliumap
+    geemap.coreutils = coreutils
+    geemap.ee_initialize = foliumap.ee_initialize
+
+    # The map component needs a browser, the fake reports no click
+    streamlit_folium = types.ModuleType('streamlit_folium')
+    streamlit_folium.st_folium = lambda *args, **kwargs: None
+
+    sys.modules.update({'ee': ee, 'geemap': geemap, 'geemap.foliumap': foliumap, 'geemap.coreutils': coreutils,
+                        'streamlit_folium': streamlit_folium})
+    return backend
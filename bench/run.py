@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES_PATH = os.path.join(ROOT, "bench", "baselines.json")
+PAGE_PATH = os.path.join(ROOT, "pages", "Kopalnia.py")
+COMPARE_PATH = os.path.join(ROOT, "pages", "Porownanie.py")
+MINE = "adamow"
+
+
+def setup(latency, n_images, hist_bins, padding):
+    # Everything below must import the fake ee, never the real client
+    os.environ["MINE_APP_CACHE_DIR"] = tempfile.mkdtemp(prefix="mine-app-bench-")
+    os.environ.pop("MINE_APP_SNAPSHOT", None)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from bench.fake_ee import install
+    from streamlit.logger import set_log_level
+    set_log_level("error")
+    backend = install()
+    backend.latency = latency
+    backend.n_images = n_images
+    backend.hist_bins = hist_bins
+    backend.padding = padding
+    # Outlines are resolved once per deployment, the measured runs start from the stored GeoJSON
+    from src.geometry import main as resolve_geometries
+    resolve_geometries([])
+    return backend
+
+
+def clear_caches():
+    import streamlit as st
+    from src.cache import cache, tile_cache
+    cache.clear()
+    tile_cache.clear()
+    st.cache_data.clear()
+
+
+def entry_points():
+    from src.funcs import build_dataset, get_dates, get_hists, get_stats, lineplot, mine_bound, plot_hist
+
+    def run_get_data():
+        build_dataset(MINE)
+
+    def run_get_dates():
+        get_dates("NDVI", build_dataset(MINE))
+
+    def run_lineplot():
+        data = build_dataset(MINE)
+        lineplot("NDVI", get_stats(mine_bound(MINE), data), get_dates("NDVI", data))
+
+    def run_plot_hist():
+        hists = get_hists(2020, "NDVI", build_dataset(MINE))
+        plot_hist("NDVI", hists[0])
+        plot_hist("NDVI", hists[1])
+
+    def run_app(path, **query_params):
+        from streamlit.testing.v1 import AppTest
+        app = AppTest.from_file(path, default_timeout=120)
+        app.query_params.update(query_params)
+        app.run()
+        if app.exception:
+            raise RuntimeError(app.exception[0].message)
+
+    def run_page():
+        run_app(PAGE_PATH, mine=MINE)
+
+    def run_compare():
+        run_app(COMPARE_PATH)
+
+    def run_api():
+        from src.api import query
+        results = query([{"kind": "stats", "mine": ["adamow", "dome"], "year": 2020},
+                         {"kind": "hists", "mine": "adamow", "index": ["NDVI", "EVI"], "year": 2020}])
+        errors = [result["error"] for result in results if "error" in result]
+        if errors:
+            raise RuntimeError(errors[0])
+
+    def run_batch():
+        from src.batch import Checkpoint, run
+        with tempfile.TemporaryDirectory() as directory:
+            progress = run(Checkpoint(os.path.join(directory, "batch.sqlite")), page_size=4, pages=2)
+        if progress.failed or progress.done != 8:
+            raise RuntimeError(f"batch scanned {progress.done} polygons, {progress.failed} failed")
+
+    return {"get_data": (run_get_data, True), "get_dates": (run_get_dates, True), "lineplot": (run_lineplot, True),
+            "plot_hist": (run_plot_hist, True), "page_cold": (run_page, True), "page_warm": (run_page, False),
+            "compare": (run_compare, True), "api": (run_api, True),
+            "batch": (run_batch, True)}
+
+
+def measure(backend, fn, cold):
+    if cold:
+        clear_caches()
+    backend.reset()
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    wall_time = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"round_trips": backend.round_trips, "wall_time": round(wall_time, 3), "peak_memory": peak}
+
+
+def regressions(name, result, baseline, tolerance):
+    problems = []
+    if result["round_trips"] > baseline["round_trips"]:
+        problems.append(f"{name}: {result['round_trips']} round trips, baseline {baseline['round_trips']}")
+    for metric in ("wall_time", "peak_memory"):
+        if result[metric] > baseline[metric] * (1 + tolerance) + (0.05 if metric == "wall_time" else 0):
+            problems.append(f"{name}: {metric} {result[metric]}, baseline {baseline[metric]}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the app against a local fake Earth Engine backend")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per simulated round trip")
+    parser.add_argument("--images", type=int, default=12, help="number of scenes in the fake time series")
+    parser.add_argument("--bins", type=int, default=20, help="histogram bins in the fake responses")
+    parser.add_argument("--padding", type=int, default=0, help="extra bytes added to each fake response")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative wall time/memory growth")
+    parser.add_argument("--update", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--only", action="append", help="run only the given entry points")
+    args = parser.parse_args(argv)
+
+    backend = setup(args.latency, args.images, args.bins, args.padding)
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+
+    results = {}
+    problems = []
+    print(f"{'entry point':<12} {'round trips':>11} {'wall [s]':>9} {'peak [MiB]':>11}")
+    for name, (fn, cold) in entry_points().items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = result = measure(backend, fn, cold)
+        print(f"{name:<12} {result['round_trips']:>11} {result['wall_time']:>9.3f} "
+              f"{result['peak_memory'] / 2 ** 20:>11.2f}")
+        if name in baselines and not args.update:
+            problems += regressions(name, result, baselines[name], args.tolerance)
+
+    if args.update:
+        with open(BASELINES_PATH, "w") as f:
+            json.dump({**baselines, **results}, f, indent=2)
+            f.write("\n")
+        print(f"baselines written to {BASELINES_PATH}")
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import streamlit as st
+import geemap.foliumap as geemap
+from src.funcs import lineplot, index_tile_url, polygon_tile_url, get_vis_params, plot_hist, text, get_hists, \
+    get_stats, equations, text2, get_catalog, catalog_years, indices, mine_bound, months_nominative, months_genitive, \
+    full_results_cached, trend_tile_urls, change_area, get_mine_data, pixel_series, pixel_plot
+from streamlit_folium import st_folium
+from src.earth_engine import ensure_initialized
+from src.registry import load_registry
+from src.snapshot import snapshot_enabled, in_snapshot
+from src.executor import submit, gather
+from src.metrics import start_rerun, show_panel, export
+
+TIMEOUT_MESSAGE = "Earth Engine nie odpowiedział w wyznaczonym czasie, odśwież stronę później"
+
+st.set_page_config(layout="wide")
+events = start_rerun()
+snapshot = snapshot_enabled()
+ensure_initialized()
+
+registry = load_registry()
+mine_ids = list(registry)
+selected = st.query_params.get("mine", mine_ids[0])
+default = mine_ids.index(selected) if selected in registry else 0
+mine_id = st.sidebar.selectbox("Wybierz kopalnię", mine_ids, index=default, format_func=lambda m: registry[m]["name"])
+st.query_params["mine"] = mine_id
+mine = registry[mine_id]
+# The change analysis needs the whole series on Earth Engine, it is not available from a snapshot
+changes = st.sidebar.toggle("Analiza zmian", disabled=snapshot)
+
+if snapshot and not in_snapshot(mine_id):
+    st.header(mine["name"])
+    st.info(f"Brak danych tej kopalni w pliku migawki, uruchom `python -m src.precompute --mine {mine_id}`")
+    st.stop()
+if snapshot:
+    data = bound = None
+else:
+    data = get_mine_data(mine_id)
+    bound = mine_bound(mine_id)
+catalog = get_catalog(data, mine=mine_id)
+
+Map = geemap.Map(center=tuple(mine["center"]), zoom=13, ee_initialize=not snapshot)
+if not snapshot:
+    Map.add_tile_layer(polygon_tile_url(mine_id, bound), name="Poligon Kopalni", attribution="Google Earth Engine")
+
+st.header(mine["name"])
+
+row1_col1, row1_col2, row1_col3 = st.columns([1, 2, 1])
+
+with row1_col3, st.container(border=True):
+    year = st.selectbox("Wybierz rok", catalog_years(catalog))
+    index = st.selectbox("Wybierz wskaźnik", indices)
+    chart = st.empty()
+    change_summary = st.empty()
+    st.markdown(text2[index], unsafe_allow_html=True)
+
+# The map goes out first, the chart and histograms fill their placeholders as the reductions arrive
+scenes = [scene for scene in catalog if scene['year'] == year]
+hist_slots = []
+if year and index:
+    if not snapshot:
+        for scene in scenes:
+            Map.add_tile_layer(index_tile_url(mine_id, scene, index, data),
+                               name=f"{index} {months_nominative[scene['month'] - 1]} {year}",
+                               attribution="Google Earth Engine")
+    with row1_col1, st.container(border=True):
+        st.markdown(text[index], unsafe_allow_html=True)
+        st.markdown('''
+        <style>
+        .katex-html {
+            font-size: 0.7em;
+        }
+        </style>''',
+                    unsafe_allow_html=True
+                    )
+        st.latex(equations[index])
+        for number, scene in enumerate(scenes):
+            with st.expander(f"Histogram dla {months_genitive[scene['month'] - 1]}", number == 0):
+                hist_slots.append(st.empty())
+    if changes:
+        area_future = submit(change_area, mine_id, index, year, data, bound, catalog)
+        for name, url in trend_tile_urls(mine_id, index, year, data, catalog):
+            Map.add_tile_layer(url, name=name, attribution="Google Earth Engine")
+    Map.add_colorbar(get_vis_params(index), label=f"Wartość {index}", layer_name=index + str(year))
+
+with row1_col2, st.container(border=True):
+    # Only clicks rerun the page, panning and zooming stay in the browser
+    Map.add_layer_control()
+    map_state = st_folium(Map, height=700, use_container_width=True, returned_objects=["last_clicked"],
+                          key=f"map_{mine_id}")
+    pixel_slot = st.empty()
+
+clicked = (map_state or {}).get("last_clicked")
+if clicked:
+    pixel_future = submit(pixel_series, mine_id, clicked["lng"], clicked["lat"], data)
+
+# A coarse preview is shown first and then replaced, unless the full-resolution results are already cached
+passes = [False] if full_results_cached(mine_id, catalog, year, index) else [True, False]
+futures = {preview: (submit(get_stats, bound, data, mine=mine_id, preview=preview),
+                     submit(get_hists, year, index, data, mine=mine_id, preview=preview)) for preview in passes}
+for preview in passes:
+    try:
+        stats, hists = gather(*futures[preview])
+    except TimeoutError:
+        chart.error(TIMEOUT_MESSAGE)
+        break
+    suffix = "_preview" if preview else ""
+    with chart.container():
+        lineplot(index, stats, [scene['date'] for scene in catalog], key=f"lineplot{suffix}")
+        if preview:
+            st.caption("Wstępne wyniki w obniżonej rozdzielczości, trwa liczenie pełnych statystyk")
+    for slot, scene, hist in zip(hist_slots, scenes, hists):
+        with slot.container():
+            plot_hist(index, hist, key=f"hist_{scene['scene']}{suffix}")
+
+if changes and year and index:
+    try:
+        area, = gather(area_future)
+    except TimeoutError:
+        change_summary.error(TIMEOUT_MESSAGE)
+    else:
+        with change_summary.container():
+            st.markdown(f"**Istotne zmiany {index}** (p < 0,05, cała seria)")
+            increase_col, decrease_col = st.columns(2)
+            increase_col.metric("Wzrost", f"{area.get('increase') or 0:.1f} ha")
+            decrease_col.metric("Spadek", f"{area.get('decrease') or 0:.1f} ha")
+            st.caption(f"Powierzchnia z danymi: {area.get('total') or 0:.1f} ha")
+
+if clicked:
+    try:
+        series, = gather(pixel_future)
+    except TimeoutError:
+        pixel_slot.error(TIMEOUT_MESSAGE)
+    else:
+        with pixel_slot.container():
+            if series is None or not any(value is not None for index in indices for value in series[index]):
+                st.info("Brak danych dla wybranego punktu, kliknij wewnątrz poligonu kopalni")
+            else:
+                pixel_plot(series, clicked["lat"], clicked["lng"], key="pixel_series")
+
+show_panel(events)
+export()
@@ -0,0 +1,36 @@
+import streamlit as st
+from src.funcs import get_comparison, compareplot, comparable_mines, indices, statistics
+from src.registry import load_registry
+from src.earth_engine import ensure_initialized
+from src.metrics import start_rerun, show_panel, export
+
+st.set_page_config(layout="wide")
+events = start_rerun()
+ensure_initialized()
+
+registry = load_registry()
+names = {mine: registry[mine]["name"] for mine in registry}
+stat_names = dict(zip(statistics, ['Średnia', 'Mediana', 'Moda']))
+
+st.header("Porównanie kopalń")
+
+mines = st.sidebar.multiselect("Wybierz kopalnie", list(registry), default=list(registry),
+                               format_func=lambda m: names[m])
+index = st.sidebar.selectbox("Wybierz wskaźnik", indices)
+stat = st.sidebar.selectbox("Wybierz statystykę", statistics, format_func=lambda s: stat_names[s])
+
+missing = [mine for mine in mines if mine not in comparable_mines(mines)]
+if missing:
+    st.info("Brak danych w pliku migawki dla: " + ", ".join(names[mine] for mine in missing))
+    mines = [mine for mine in mines if mine not in missing]
+if mines:
+    windows, comparison = get_comparison(mines)
+    if windows:
+        compareplot(index, stat, comparison, windows, names)
+    else:
+        st.info("Wybrane kopalnie nie mają wspólnych okresów obserwacji")
+else:
+    st.info("Wybierz co najmniej jedną kopalnię")
+
+show_panel(events)
+export()
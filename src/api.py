@@ -0,0 +1,204 @@
+import argparse
+import concurrent.futures
+import json
+import logging
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.earth_engine import ensure_initialized
+from src.executor import gather, submit
+from src.funcs import get_catalog, get_hists, get_mine_data, get_stats, indices, mine_bound
+from src.registry import load_registry
+from src.snapshot import in_snapshot, snapshot_enabled
+
+logger = logging.getLogger(__name__)
+
+
+class NotFound(KeyError):
+    # A lookup miss in the request itself, the only KeyError answered with 404
+    pass
+
+# Everything goes through the same cached, coalesced functions as the pages, so the API and the app warm each
+# other's cache and concurrent identical queries share one Earth Engine request. Every call that may reach Earth
+# Engine is submitted to the shared executor, so query and handler threads only wait and the API stays within its
+# concurrency cap and backoff
+
+
+def _mine(mine):
+    if mine not in load_registry():
+        raise NotFound(f"unknown mine {mine!r}")
+    ensure_initialized()
+    if snapshot_enabled():
+        if not in_snapshot(mine):
+            raise NotFound(f"{mine!r} is not in the snapshot")
+        return None, None
+    return tuple(gather(submit(get_mine_data, mine), submit(mine_bound, mine)))
+
+
+def _indices(index):
+    selected = [index] if isinstance(index, str) else list(index or indices)
+    unknown = [name for name in selected if name not in indices]
+    if unknown:
+        raise ValueError(f"unknown index {', '.join(unknown)}, expected one of {', '.join(indices)}")
+    return selected
+
+
+def _year(catalog, year):
+    if year is None:
+        return None
+    year = int(year)
+    if year not in {scene['year'] for scene in catalog}:
+        raise ValueError(f"no scenes in {year}")
+    return year
+
+
+def _message(error):
+    # KeyError quotes its message, the other errors do not
+    message = error.args[0] if isinstance(error, KeyError) and error.args else str(error)
+    return message if isinstance(error, (NotFound, ValueError, TypeError)) else f"{type(error).__name__}: {message}"
+
+
+def mines():
+    return [{'id': mine['id'], 'name': mine['name']} for mine in load_registry().values()]
+
+
+def dates(mine):
+    data, _ = _mine(mine)
+    catalog, = gather(submit(get_catalog, data, mine))
+    return {'mine': mine, 'dates': [scene['date'] for scene in catalog]}
+
+
+def stats(mine, index=None, year=None):
+    # Mean, median and mode per scene, optionally limited to some indices and one year
+    data, bound = _mine(mine)
+    catalog, = gather(submit(get_catalog, data, mine))
+    selected, year = _indices(index), _year(catalog, year)
+    positions = [i for i, scene in enumerate(catalog) if year is None or scene['year'] == year]
+    all_stats, = gather(submit(get_stats, bound, data, mine=mine, catalog=catalog))
+    return {'mine': mine, 'year': year, 'dates': [catalog[i]['date'] for i in positions],
+            'stats': {name: {stat: [values[i] for i in positions] for stat, values in all_stats[name].items()}
+                      for name in selected}}
+
+
+def hists(mine, index=None, year=None):
+    # fixedHistogram rows [bucket_min, count] per scene of the year, for each selected index
+    data, _ = _mine(mine)
+    catalog, = gather(submit(get_catalog, data, mine))
+    selected, year = _indices(index), _year(catalog, year)
+    if year is None:
+        raise ValueError("histograms need a year")
+    futures = {name: submit(get_hists, year, name, data, mine=mine) for name in selected}
+    return {'mine': mine, 'year': year, 'dates': [scene['date'] for scene in catalog if scene['year'] == year],
+            'hists': dict(zip(futures, gather(*futures.values())))}
+
+
+QUERIES = {'mines': mines, 'dates': dates, 'stats': stats, 'hists': hists}
+
+
+def query(queries, max_workers=16):
+    # Bulk form: [{"kind": "stats", "mine": "adamow", "index": ["NDVI", "EVI"], "year": 2020}, ...]. A query
+    # may list several mines, the answers come back in order and a failing query does not fail the others.
+    # The queries fan out on their own threads, which only wait on the shared executor
+    expanded = []
+    for item in queries:
+        item = dict(item)
+        kind = item.pop('kind', None)
+        selected = item.pop('mine', None)
+        for mine in [selected] if selected is None or isinstance(selected, str) else selected:
+            expanded.append((kind, item if mine is None else dict(item, mine=mine)))
+
+    def run(kind, arguments):
+        try:
+            if kind not in QUERIES:
+                raise ValueError(f"unknown kind {kind!r}, expected one of {', '.join(QUERIES)}")
+            return {'kind': kind, 'query': arguments, 'result': QUERIES[kind](**arguments)}
+        except Exception as error:
+            # Earth Engine failures and timeouts included, one failing query leaves the others their answers
+            if not isinstance(error, (NotFound, ValueError, TypeError)):
+                logger.exception("query %s %s failed", kind, arguments)
+            return {'kind': kind, 'query': arguments, 'error': _message(error)}
+    if not expanded:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(expanded))) as pool:
+        return list(pool.map(lambda job: run(*job), expanded))
+
+
+class Handler(BaseHTTPRequestHandler):
+    # GET /mines, /mines/<mine>/dates, /mines/<mine>/stats?index=NDVI&index=EVI&year=2020,
+    # /mines/<mine>/hists?index=NDVI&year=2020 and POST /query with {"queries": [...]}
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        params = urllib.parse.parse_qs(url.query)
+        arguments = {'index': params.get('index'), 'year': params.get('year', [None])[0]}
+        if parts == ['mines']:
+            self.respond(mines)
+        elif len(parts) == 3 and parts[0] == 'mines' and parts[2] == 'dates':
+            self.respond(dates, parts[1])
+        elif len(parts) == 3 and parts[0] == 'mines' and parts[2] in ('stats', 'hists'):
+            self.respond(QUERIES[parts[2]], parts[1], **arguments)
+        else:
+            self.send_json(404, {'error': f"no such endpoint {url.path}"})
+
+    def do_POST(self):
+        if urllib.parse.urlsplit(self.path).path.strip('/') != 'query':
+            self.send_json(404, {'error': f"no such endpoint {self.path}"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or '{}')
+        except ValueError as error:
+            # A bad Content-Length as well as invalid JSON, JSONDecodeError is a ValueError
+            self.send_json(400, {'error': f"invalid request body: {error}"})
+            return
+        if not isinstance(body, dict) or not isinstance(body.get('queries', []), list) \
+                or not all(isinstance(item, dict) for item in body.get('queries', [])):
+            self.send_json(400, {'error': 'expected {"queries": [{...}, ...]}'})
+            return
+        self.respond(lambda: {'results': query(body.get('queries', []))})
+
+    def respond(self, fn, *args, **kwargs):
+        try:
+            self.send_json(200, fn(*args, **kwargs))
+        except NotFound as error:
+            self.send_json(404, {'error': _message(error)})
+        except ValueError as error:
+            self.send_json(400, {'error': str(error)})
+        except Exception as error:
+            logger.exception("%s failed", self.path)
+            self.send_json(500, {'error': _message(error)})
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info("%s %s", self.address_string(), format % args)
+
+
+def serve(host="127.0.0.1", port=8502):
+    server = ThreadingHTTPServer((host, port), Handler)
+    logger.info("serving on http://%s:%d", host, server.server_port)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve mine statistics, histograms and dates as JSON")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    server = serve(args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import ee
+
+from src.cache import CACHE_DIR
+from src.executor import MAX_WORKERS, submit
+from src.funcs import DEFAULT_SERIES, get_catalog, get_stats, index_series, indices, windows_of
+from src.geometry import GLOBAL_MINING, SIMPLIFY_TOLERANCE
+from src.metrics import get_info
+
+BATCH_PATH = os.path.join(CACHE_DIR, "batch.sqlite")
+PAGE_SIZE = 500
+MAX_ATTEMPTS = 3
+REPORT_INTERVAL = 60
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS pages (page INTEGER PRIMARY KEY, last_id TEXT, count INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS polygons (
+    id TEXT PRIMARY KEY, page INTEGER NOT NULL, geometry TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, error TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    polygon TEXT NOT NULL, scene TEXT NOT NULL, date TEXT NOT NULL, index_name TEXT NOT NULL,
+    mean REAL, median REAL, mode REAL, PRIMARY KEY (polygon, scene, index_name)
+);
+CREATE INDEX IF NOT EXISTS polygons_page ON polygons (page, status);
+"""
+
+
+class Checkpoint:
+    # Listed pages, every polygon's state and the finished (polygon, scene) statistics live in one SQLite file.
+    # A polygon's results and its 'done' mark are written in one transaction, so a restart never redoes or
+    # half-keeps a polygon
+    def __init__(self, path=BATCH_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get_meta(self, key):
+        with self._connect() as connection:
+            row = connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set_meta(self, key, value):
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def get_page(self, page):
+        # The last polygon id and the number of polygons of a listed page, None if it has not been listed
+        with self._connect() as connection:
+            return connection.execute("SELECT last_id, count FROM pages WHERE page = ?", (page,)).fetchone()
+
+    def add_page(self, page, features):
+        # A polygon listed again keeps its state and moves to the page it is listed on now
+        with self._connect() as connection:
+            connection.executemany("INSERT INTO polygons (id, page, geometry) VALUES (?, ?, ?) "
+                                   "ON CONFLICT (id) DO UPDATE SET page = excluded.page",
+                                   [(feature['id'], page, json.dumps(feature['geometry'])) for feature in features])
+            connection.execute("INSERT INTO pages (page, last_id, count) VALUES (?, ?, ?)",
+                               (page, features[-1]['id'] if features else None, len(features)))
+        return features[-1]['id'] if features else None, len(features)
+
+    def clear_pages(self):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM pages")
+
+    def pending(self, page, max_attempts):
+        with self._connect() as connection:
+            return connection.execute(
+                "SELECT id, geometry FROM polygons WHERE page = ? AND status != 'done' AND attempts < ? ORDER BY id",
+                (page, max_attempts)).fetchall()
+
+    def finish(self, polygon, rows):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM results WHERE polygon = ?", (polygon,))
+            connection.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            connection.execute("UPDATE polygons SET status = 'done', attempts = attempts + 1, error = NULL "
+                               "WHERE id = ?", (polygon,))
+
+    def fail(self, polygon, error):
+        with self._connect() as connection:
+            connection.execute("UPDATE polygons SET status = 'failed', attempts = attempts + 1, error = ? WHERE id = ?",
+                               (error, polygon))
+
+    def counts(self):
+        with self._connect() as connection:
+            return dict(connection.execute("SELECT status, COUNT(*) FROM polygons GROUP BY status").fetchall())
+
+
+def collection_size():
+    return get_info(ee.FeatureCollection(GLOBAL_MINING).size(), 'batch_size')
+
+
+def list_page(after, page_size=PAGE_SIZE):
+    # The page_size polygons following the id `after` in id order, with their outlines simplified like the
+    # registry mines' ones. A filter on the key instead of an offset, so the server does not skip over every
+    # earlier polygon for each page
+    collection = ee.FeatureCollection(GLOBAL_MINING)
+    if after is not None:
+        collection = collection.filter(ee.Filter.gt('system:index', after))
+    features = collection.limit(page_size, 'system:index')
+    result = get_info(features.map(lambda feature: feature.simplify(SIMPLIFY_TOLERANCE).select([])), 'batch_page')
+    return [{'id': feature['id'], 'geometry': feature['geometry']} for feature in result['features']]
+
+
+def scan_polygon(polygon, geometry, windows):
+    # The app's pipeline for an arbitrary polygon: best scene per window, indices clipped to the outline, one
+    # reduction for the statistics of every scene. Nothing goes through the per-mine result cache
+    bound = ee.Geometry(geometry)
+    data = index_series(bound, bound, windows)
+    catalog = get_catalog(data)
+    if not catalog:
+        return []
+    stats = get_stats(bound, data, catalog=catalog, approximate=False)
+    return [(polygon, scene['scene'], scene['date'], index,
+             stats[index]['mean'][position], stats[index]['median'][position], stats[index]['mode'][position])
+            for position, scene in enumerate(catalog) for index in indices]
+
+
+class Progress:
+    def __init__(self, interval=REPORT_INTERVAL, clock=time.monotonic):
+        self.clock = clock
+        self.interval = interval
+        self.start = self.reported = clock()
+        self.done = 0
+        self.failed = 0
+
+    def rate(self):
+        # Mines per hour finished in this run
+        elapsed = self.clock() - self.start
+        return self.done / elapsed * 3600 if elapsed else 0.0
+
+    def record(self, ok, checkpoint):
+        if ok:
+            self.done += 1
+        else:
+            self.failed += 1
+        if self.clock() - self.reported >= self.interval:
+            self.report(checkpoint)
+
+    def report(self, checkpoint):
+        self.reported = self.clock()
+        counts = checkpoint.counts()
+        logger.info("%d mines done and %d failed in this run, %.0f mines/h; %d done, %d failed, %d pending overall",
+                    self.done, self.failed, self.rate(), counts.get('done', 0), counts.get('failed', 0),
+                    counts.get('pending', 0))
+
+
+def run(checkpoint, workers=MAX_WORKERS, page_size=PAGE_SIZE, max_attempts=MAX_ATTEMPTS, pages=None,
+        windows=None, progress=None, lister=list_page, scan=scan_polygon, sizer=collection_size):
+    # Pages are listed and scanned one after another, at most `workers` polygons are in flight at a time and
+    # each runs on the shared Earth Engine executor, whose retries back off on rate limits. Failed polygons are
+    # retried by later runs until they have used max_attempts. The collection size is read again by every run
+    # and when it changed every page is listed again, so polygons added since are picked up
+    windows = windows or windows_of(DEFAULT_SERIES)
+    progress = progress or Progress()
+    size = sizer()
+    if checkpoint.get_meta('size') != size:
+        checkpoint.clear_pages()
+        checkpoint.set_meta('size', size)
+    in_flight = {}
+
+    def settle(return_when):
+        done, _ = concurrent.futures.wait(in_flight, return_when=return_when)
+        for future in done:
+            polygon = in_flight.pop(future)
+            try:
+                checkpoint.finish(polygon, future.result())
+                progress.record(True, checkpoint)
+            except Exception as error:
+                logger.warning("%s failed: %s", polygon, error)
+                checkpoint.fail(polygon, str(error))
+                progress.record(False, checkpoint)
+
+    page, last_id, count = 0, None, page_size
+    while count == page_size and (pages is None or page < pages):
+        listed = checkpoint.get_page(page)
+        last_id, count = listed if listed is not None else checkpoint.add_page(page, lister(last_id, page_size))
+        for polygon, geometry in checkpoint.pending(page, max_attempts):
+            if len(in_flight) >= workers:
+                settle(concurrent.futures.FIRST_COMPLETED)
+            in_flight[submit(scan, polygon, json.loads(geometry), windows)] = polygon
+        page += 1
+    if in_flight:
+        settle(concurrent.futures.ALL_COMPLETED)
+    progress.report(checkpoint)
+    return progress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute index statistics for every polygon of global_mining_polygons")
+    parser.add_argument("--output", default=BATCH_PATH, help="SQLite checkpoint, an existing one is resumed")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="polygons computed at the same time")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE, help="polygons listed per request")
+    parser.add_argument("--pages", type=int, help="stop after the given number of pages")
+    parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS,
+                        help="attempts per polygon across runs before it is left as failed")
+    parser.add_argument("--report", type=float, default=REPORT_INTERVAL, help="seconds between progress reports")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    from src.earth_engine import ensure_initialized
+    ensure_initialized()
+    checkpoint = Checkpoint(args.output)
+    # The page boundaries must not move between runs of one checkpoint
+    if checkpoint.get_meta('page_size') not in (None, args.page_size):
+        parser.error(f"{args.output} was listed with --page-size {checkpoint.get_meta('page_size')}")
+    checkpoint.set_meta('page_size', args.page_size)
+    run(checkpoint, args.workers, args.page_size, args.max_attempts, args.pages, progress=Progress(args.report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from src.metrics import record_cache
+from src.singleflight import digest, file_lock, flights
+
+CACHE_DIR = os.environ.get("MINE_APP_CACHE_DIR",
+                           os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache"))
+CACHE_TTL = 7 * 24 * 3600
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Earth Engine map IDs expire, so tile URL templates are kept for a shorter time
+TILE_TTL = 6 * 3600
+# Expired and least recently used entries are swept every this many writes, not on each one
+EVICT_EVERY = 64
+# A read refreshes last_used only when it is older than this, so most hits do not write
+TOUCH_INTERVAL = 60
+
+MISSING = object()
+
+
+def make_key(mine, index=None, year=None, image=None, reducer=None, scale=None):
+    return json.dumps([mine, index, year, image, reducer, scale])
+
+
+class ResultCache:
+    # Results are stored as JSON in SQLite so every worker process shares the same warm entries
+    def __init__(self, path=None, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES, clock=time.time, evict_every=EVICT_EVERY):
+        self.path = path or os.path.join(CACHE_DIR, "results.sqlite")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.evict_every = evict_every
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._created = False
+
+    def _create(self):
+        # Deferred to the first use, so importing the app creates no files, e.g. on a read-only snapshot deployment
+        with self._lock:
+            if self._created:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30)
+            try:
+                with db:
+                    db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                               "key TEXT PRIMARY KEY, value TEXT, created REAL, last_used REAL, size INTEGER)")
+                    db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+                    db.execute("CREATE INDEX IF NOT EXISTS entries_created ON entries (created)")
+            finally:
+                db.close()
+            self._created = True
+
+    @contextlib.contextmanager
+    def _connect(self):
+        self._create()
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, key, site=None, ttl=None, count=True):
+        now = self.clock()
+        ttl = self.ttl if ttl is None else ttl
+        with self._connect() as db:
+            row = db.execute("SELECT value, created, last_used FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > ttl:
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+            if row is not None and now - row[2] >= TOUCH_INTERVAL:
+                db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+        if count:
+            with self._lock:
+                if row is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        if site is not None:
+            record_cache(site, row is not None)
+        return MISSING if row is None else json.loads(row[0])
+
+    def has(self, key, ttl=None):
+        # Existence check that neither counts as a lookup nor refreshes the entry
+        ttl = self.ttl if ttl is None else ttl
+        with self._connect() as db:
+            row = db.execute("SELECT created FROM entries WHERE key = ?", (key,)).fetchone()
+        return row is not None and self.clock() - row[0] <= ttl
+
+    def set(self, key, value):
+        now = self.clock()
+        value = json.dumps(value)
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", (key, value, now, now, len(value)))
+            with self._lock:
+                self._writes += 1
+                evict = self._writes % self.evict_every == 0
+            if evict:
+                self._evict(db)
+
+    def _evict(self, db):
+        db.execute("DELETE FROM entries WHERE created < ?", (self.clock() - self.ttl,))
+        total = 0
+        stale = []
+        for key, size in db.execute("SELECT key, size FROM entries ORDER BY last_used DESC"):
+            total += size
+            if total > self.max_bytes:
+                stale.append((key,))
+        db.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+    @property
+    def lock_dir(self):
+        return os.path.join(os.path.dirname(self.path), "locks")
+
+    def get_or_compute(self, key, compute, site=None, ttl=None):
+        value = self.get(key, site, ttl)
+        if value is not MISSING:
+            return value
+
+        def compute_once():
+            # Whoever held the lock before may have stored the value meanwhile, the lookup above already counted
+            with file_lock([self.path, key], self.lock_dir):
+                value = self.get(key, ttl=ttl, count=False)
+                if value is MISSING:
+                    value = compute()
+                    self.set(key, value)
+                return value
+        return flights.do(digest(self.path, key), compute_once)
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM entries")
+
+    def stats(self):
+        with self._connect() as db:
+            entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+
+cache = ResultCache()
+tile_cache = ResultCache(os.path.join(CACHE_DIR, "tiles.sqlite"), ttl=TILE_TTL)
+
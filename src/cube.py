@@ -0,0 +1,219 @@
+import argparse
+import functools
+import logging
+import math
+import os
+import time
+
+from src.cache import CACHE_DIR
+from src.metrics import record_request
+
+CUBE_DIR = os.environ.get("MINE_APP_CUBE_DIR")
+CUBE_SCALE = 30
+# One chunk holds a 256 x 256 window of a single index of a single scene
+CHUNK = 256
+# Pixels are requested from Earth Engine in windows of 1024 x 1024, well under the computePixels limits
+BLOCK = 1024
+FILL = -9999
+# Median and mode come from a sketch this fine, 0.001 wide on the [-1, 1] indices
+STATS_BINS = 2000
+
+logger = logging.getLogger(__name__)
+
+
+def cube_enabled():
+    return bool(CUBE_DIR)
+
+
+def cube_path(mine, root=None):
+    return os.path.join(root or CUBE_DIR or os.path.join(CACHE_DIR, "cubes"), f"{mine}.zarr")
+
+
+def has_cube(mine):
+    return cube_enabled() and os.path.exists(cube_path(mine))
+
+
+def open_cube(mine, root=None, mode='r'):
+    import zarr
+    return zarr.open_array(cube_path(mine, root), mode=mode)
+
+
+def cube_grid(bounds):
+    # bounds is the GeoJSON polygon of the mine's bounding box. The grid is in EPSG:4326 with the longitude
+    # step stretched by the latitude, so pixels are roughly CUBE_SCALE metres square on the ground
+    lons = [lon for lon, _ in bounds['coordinates'][0]]
+    lats = [lat for _, lat in bounds['coordinates'][0]]
+    scale_y = CUBE_SCALE / 111320
+    scale_x = scale_y / math.cos(math.radians((min(lats) + max(lats)) / 2))
+    return {'x0': min(lons), 'y0': max(lats), 'scale_x': scale_x, 'scale_y': scale_y,
+            'width': math.ceil((max(lons) - min(lons)) / scale_x),
+            'height': math.ceil((max(lats) - min(lats)) / scale_y)}
+
+
+def fetch_block(image, grid, x, y, width, height):
+    import ee
+    import numpy as np
+    from src.funcs import indices
+    start = time.perf_counter()
+    pixels = ee.data.computePixels({
+        'expression': image,
+        'fileFormat': 'NUMPY_NDARRAY',
+        'grid': {
+            'dimensions': {'width': width, 'height': height},
+            'affineTransform': {'scaleX': grid['scale_x'], 'shearX': 0,
+                                'translateX': grid['x0'] + x * grid['scale_x'],
+                                'shearY': 0, 'scaleY': -grid['scale_y'],
+                                'translateY': grid['y0'] - y * grid['scale_y']},
+            'crsCode': 'EPSG:4326',
+        },
+    })
+    record_request('computePixels', time.perf_counter() - start, pixels.nbytes)
+    block = np.stack([pixels[index] for index in indices]).astype(np.float32)
+    block[block == FILL] = np.nan
+    return block
+
+
+def export_cube(mine, root=None):
+    # Appends the scenes that are not in the cube yet, so a refresh only downloads new acquisitions
+    import ee
+    import numpy as np
+    import zarr
+    from src.executor import gather, submit
+    from src.funcs import build_dataset, get_catalog, indices
+    from src.geometry import geometry_bounds
+
+    data = build_dataset(mine)
+    catalog = get_catalog(data)
+    path = cube_path(mine, root)
+    if os.path.exists(path):
+        cube = open_cube(mine, root, mode='a')
+        grid = cube.attrs['grid']
+    else:
+        grid = cube_grid(geometry_bounds(mine))
+        cube = zarr.create_array(store=path, shape=(0, len(indices), grid['height'], grid['width']),
+                                 chunks=(1, 1, CHUNK, CHUNK), dtype='float32', fill_value=np.nan)
+        cube.attrs.update({'grid': grid, 'indices': indices, 'catalog': [], 'updated': time.time()})
+    stored = cube.attrs['catalog']
+    known = {scene['scene'] for scene in stored}
+    for scene in catalog:
+        if scene['scene'] in known:
+            continue
+        logger.info("%s: exporting %s", mine, scene['date'])
+        image = data.filter(ee.Filter.eq('scene', scene['scene'])).first().select(indices).unmask(FILL).toFloat()
+        windows = [(x, y, min(BLOCK, grid['width'] - x), min(BLOCK, grid['height'] - y))
+                   for y in range(0, grid['height'], BLOCK) for x in range(0, grid['width'], BLOCK)]
+        blocks = gather(*[submit(fetch_block, image, grid, *window) for window in windows])
+        slot = len(stored)
+        cube.resize((slot + 1,) + cube.shape[1:])
+        for (x, y, width, height), block in zip(windows, blocks):
+            cube[slot, :, y:y + height, x:x + width] = block
+        # The catalog is written after each scene, so an interrupted export keeps what it downloaded
+        stored = stored + [scene]
+        cube.attrs.update({'catalog': stored, 'updated': time.time()})
+    return cube
+
+
+def cube_catalog(mine):
+    # Scenes are stored in the order they were exported, the catalog is returned by date with the stored slot
+    catalog = open_cube(mine).attrs['catalog']
+    return sorted((dict(scene, slot=slot) for slot, scene in enumerate(catalog)), key=lambda scene: scene['date'])
+
+
+@functools.lru_cache(maxsize=512)
+def _sketch(path, updated, slot, position, low, high):
+    # Streams one index of one scene in chunk rows into a mergeable histogram sketch
+    import zarr
+    from src.sketch import HistogramSketch
+    cube = zarr.open_array(path, mode='r')
+    sketch = HistogramSketch(low, high, STATS_BINS)
+    for y in range(0, cube.shape[2], CHUNK):
+        sketch.update(cube[slot, position, y:y + CHUNK])
+    return sketch
+
+
+def sketch(mine, scene, index):
+    from src.funcs import get_vis_params, indices
+    vis_params = get_vis_params(index)
+    cube = open_cube(mine)
+    return _sketch(cube_path(mine), cube.attrs['updated'], scene['slot'], indices.index(index),
+                   vis_params['min'], vis_params['max'])
+
+
+def exact_stats(mine, scene, index):
+    # Fallback for a median or mode outside the sketch range, reads the whole plane of one scene and index
+    import numpy as np
+    from src.funcs import indices
+    values = open_cube(mine)[scene['slot'], indices.index(index)]
+    values = values[np.isfinite(values)]
+    unique, counts = np.unique(values, return_counts=True)
+    return {'mean': float(values.mean()), 'median': float(np.median(values)),
+            'mode': float(unique[np.argmax(counts)]), 'error': 0.0}
+
+
+def cube_stats(mine):
+    from src.funcs import indices, statistics
+    catalog = cube_catalog(mine)
+    stats = {index: {stat: [] for stat in statistics + ['error']} for index in indices}
+    for index in indices:
+        for scene in catalog:
+            scene_sketch = sketch(mine, scene, index)
+            if scene_sketch.is_exact_needed():
+                values = exact_stats(mine, scene, index)
+            else:
+                values = {'mean': scene_sketch.mean(), 'median': scene_sketch.median(), 'mode': scene_sketch.mode(),
+                          'error': scene_sketch.error if scene_sketch.count else None}
+            for stat, value in values.items():
+                stats[index][stat].append(value)
+    return stats
+
+
+def cube_hists(mine, year, index):
+    from src.funcs import get_vis_params, HIST_BINS
+    vis_params = get_vis_params(index)
+    width = (vis_params['max'] - vis_params['min']) / HIST_BINS
+    hists = []
+    for scene in cube_catalog(mine):
+        if scene['year'] != year:
+            continue
+        counts = sketch(mine, scene, index).coarsen(HIST_BINS)
+        hists.append([[vis_params['min'] + k * width, int(count)] for k, count in enumerate(counts)])
+    return hists
+
+
+def cube_pixel_series(mine, lon, lat):
+    # Reads a single pixel of every scene and index, which touches one chunk per scene and index
+    import numpy as np
+    from src.funcs import indices
+    cube = open_cube(mine)
+    grid = cube.attrs['grid']
+    x = math.floor((lon - grid['x0']) / grid['scale_x'])
+    y = math.floor((grid['y0'] - lat) / grid['scale_y'])
+    if not (0 <= x < grid['width'] and 0 <= y < grid['height']):
+        return None
+    catalog = cube_catalog(mine)
+    values = cube[:, :, y, x]
+    series = {'date': [scene['date'] for scene in catalog]}
+    for position, index in enumerate(indices):
+        series[index] = [None if np.isnan(values[scene['slot'], position]) else float(values[scene['slot'], position])
+                         for scene in catalog]
+    return series
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export mine index stacks into chunked local raster cubes")
+    parser.add_argument("--output", help="directory of the cubes, defaults to MINE_APP_CUBE_DIR or .cache/cubes")
+    parser.add_argument("--mine", action="append", help="limit the export to the given mines, may be repeated")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    from src.earth_engine import ensure_initialized
+    from src.registry import load_registry
+    ensure_initialized()
+    for mine in args.mine or load_registry():
+        logger.info("exporting %s", mine)
+        cube = export_cube(mine, args.output)
+        logger.info("%s: %d scenes in %s", mine, cube.shape[0], cube_path(mine, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+import streamlit as st
+
+from src.snapshot import snapshot_enabled
+
+
+@st.cache_resource
+def initialize(token_name="EARTHENGINE_TOKEN"):
+    # Runs once per process, every page, rerun and worker thread shares the initialized client
+    import ee
+    from geemap.coreutils import ee_initialize
+    from src.executor import REQUEST_TIMEOUT
+    ee_initialize(token_name=token_name)
+    # gather only stops waiting, the deadline makes a hung request fail and frees its worker thread
+    ee.data.setDeadline(REQUEST_TIMEOUT * 1000)
+
+
+def ensure_initialized():
+    if not snapshot_enabled():
+        initialize()
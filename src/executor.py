@@ -0,0 +1,57 @@
+import concurrent.futures
+import contextvars
+import os
+import random
+import threading
+import time
+
+MAX_WORKERS = int(os.environ.get("MINE_APP_EE_WORKERS", 8))
+# Earth Engine deadline of a single request
+REQUEST_TIMEOUT = 300
+# Waiting on a future covers all of its requests and backoff retries, so it is much longer than one deadline
+GATHER_TIMEOUT = 1800
+RETRIES = 5
+BACKOFF_BASE = 1.0
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="ee")
+    return _executor
+
+
+def is_retryable(error):
+    message = str(error).lower()
+    return any(marker in message for marker in ('429', 'too many requests', 'quota', 'rate limit'))
+
+
+def with_backoff(fn, *args, retries=RETRIES, sleep=time.sleep, **kwargs):
+    for attempt in range(retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as error:
+            if attempt == retries or not is_retryable(error):
+                raise
+            # Full jitter keeps parallel workers from retrying in lockstep
+            sleep(random.uniform(0, BACKOFF_BASE * 2 ** attempt))
+
+
+def submit(fn, *args, **kwargs):
+    # The caller's context is carried over so per-rerun instrumentation sees requests made in the pool
+    context = contextvars.copy_context()
+    return get_executor().submit(context.run, with_backoff, fn, *args, **kwargs)
+
+
+def gather(*futures, timeout=GATHER_TIMEOUT):
+    done, pending = concurrent.futures.wait(futures, timeout=timeout)
+    # Only futures still queued are cancelled, running ones end at the request deadline
+    for future in pending:
+        future.cancel()
+    if pending:
+        raise TimeoutError(f"{len(pending)} Earth Engine task(s) did not finish within {timeout} s")
+    return [future.result() for future in futures]
@@ -1,151 +1,318 @@
+import collections
+import datetime
+import json
+import os
+import threading
 import ee
 import streamlit as st
-import geemap.foliumap as geemap
-import plotly.express as px
-import plotly.graph_objects as go
-import numpy as np
-@st.cache_data
-def ee_authenticate(token_name="EARTHENGINE_TOKEN"):
-    geemap.ee_initialize(token_name=token_name)
+from src.cache import cache, tile_cache, make_key, MISSING
+from src.registry import get_mine
+from src.geometry import mine_geometry
+from src.metrics import get_info, timed
+from src.singleflight import file_lock
+from src.snapshot import snapshot_enabled, in_snapshot, snapshot_catalog, snapshot_stats, snapshot_hists
+from src.cube import has_cube, cube_catalog, cube_stats, cube_hists, cube_pixel_series
+
+
+def acquisition_date(image):
+    # Stays an ee.String, so the date is resolved on the server together with the image
+    return ee.Date(image.get('system:time_start')).format('YYYY-MM-dd')
+
+
+# The calculate_* functions take an image already scaled to reflectance, calculate_indices scales it once
 
 
-ee_authenticate(token_name="EARTHENGINE_TOKEN")
 def calculate_ndvi(image):
-    date = ee.Date(image.get('system:time_start')).format('YYYY-MM-dd').getInfo()
-    image = image.divide(10000)
     return (image.select('B8').subtract(image.select('B4'))).divide(image.select('B8').add(image.select('B4'))).rename(
-        'NDVI').set('date', date)
+        'NDVI')
 
 
 def calculate_ndwi1(image):
-    date = ee.Date(image.get('system:time_start')).format('YYYY-MM-dd').getInfo()
-    image = image.divide(10000)
     return (image.select('B8A').subtract(image.select('B12'))).divide(
-        image.select('B8A').add(image.select('B12'))).rename('NDWI1').set('date', date)
+        image.select('B8A').add(image.select('B12'))).rename('NDWI1')
 
 
 def calculate_ndwi2(image):
-    date = ee.Date(image.get('system:time_start')).format('YYYY-MM-dd').getInfo()
-    image = image.divide(10000)
     return (image.select('B3').subtract(image.select('B8'))).divide(image.select('B8').add(image.select('B3'))).rename(
-        'NDWI2').set('date', date)
+        'NDWI2')
 
 
 def calculate_evi(image):
-    date = ee.Date(image.get('system:time_start')).format('YYYY-MM-dd').getInfo()
-    image = image.divide(10000)
     evi = image.expression(
         '2.5 * (NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1)', {
             'NIR': image.select('B8'),
             'RED': image.select('B4'),
             'BLUE': image.select('B2')
         })
-    return evi.rename('EVI').set('date', date)
+    return evi.rename('EVI')
 
 
 def calculate_nmdi(image):
-    date = ee.Date(image.get('system:time_start')).format('YYYY-MM-dd').getInfo()
-    image = image.divide(10000)
     nmdi = image.expression(
         '(NIR - (SWIR1-SWIR2)) / (NIR + (SWIR1 - SWIR2))', {
             'NIR': image.select('B8A'),
             'SWIR1': image.select('B11'),
             'SWIR2': image.select('B12')})
-    mask = nmdi.lt(2).And(nmdi.gt(0))
-    return nmdi.rename("NMDI").set('date', date)
+    return nmdi.rename("NMDI")
 
 
 def calculate_msavi(image):
-    date = ee.Date(image.get('system:time_start')).format('YYYY-MM-dd').getInfo()
-    image = image.divide(10000)
     msavi = image.expression(
         '(2*NIR + 1 - sqrt((2*NIR+1)**2-8*(NIR-RED)))/2', {
             'NIR': image.select('B8'),
             'RED': image.select('B4')})
-    return msavi.rename('MSAVI2').set('date', date)
+    return msavi.rename('MSAVI2')
 
 
 def calculate_msi(image):
-    date = ee.Date(image.get('system:time_start')).format('YYYY-MM-dd').getInfo()
-    image = image.divide(10000)
     msi = image.select('B11').divide(image.select('B8A'))
-    return msi.rename('MSI').set('date', date)
+    return msi.rename('MSI')
 
 
-ims = {2018: ['0', '1'], 2019: ['2', '3'], 2020: ['4', '5'], 2021: ['6', '7'], 2022: ['8', '9'], 2023: ['10', '11']}
+DEFAULT_SERIES = {"start_year": 2018, "months": [5, 8]}
+CATALOG_TTL = 24 * 3600
+months_nominative = ['Styczeń', 'Luty', 'Marzec', 'Kwiecień', 'Maj', 'Czerwiec', 'Lipiec', 'Sierpień', 'Wrzesień',
+                     'Październik', 'Listopad', 'Grudzień']
+months_genitive = ['stycznia', 'lutego', 'marca', 'kwietnia', 'maja', 'czerwca', 'lipca', 'sierpnia', 'września',
+                   'października', 'listopada', 'grudnia']
 
 
-def best_image(year, roi):
-    start_date_may = ee.Date.fromYMD(year, 5, 1)
-    end_date_may = start_date_may.advance(1, 'month')
+def series_windows(mine, today=None):
+    # (year, month) windows of the mine's series up to the current month, e.g. May and August of every year
+    return windows_of({**DEFAULT_SERIES, **get_mine(mine).get("series", {})}, today)
 
-    start_date_aug = ee.Date.fromYMD(year, 8, 1)
-    end_date_aug = start_date_aug.advance(1, 'month')
 
-    # Filter for May and August images
-    may = ee.ImageCollection('COPERNICUS/S2_HARMONIZED') \
-        .filterBounds(roi) \
-        .filterDate(start_date_may, end_date_may) \
-        .sort("CLOUDY_PIXEL_PERCENTAGE").first()
+def windows_of(series, today=None):
+    today = today or datetime.date.today()
+    return [[year, month] for year in range(series["start_year"], today.year + 1) for month in series["months"]
+            if (year, month) <= (today.year, today.month)]
 
-    aug = ee.ImageCollection('COPERNICUS/S2_HARMONIZED') \
-        .filterBounds(roi) \
-        .filterDate(start_date_aug, end_date_aug) \
-        .sort("CLOUDY_PIXEL_PERCENTAGE") \
-        .first()
 
-    # Get a list of images
-    images_list = ee.List([may, aug])
+def best_image(sentinel, year, month):
+    start_date = ee.Date.fromYMD(year, month, 1)
+    end_date = start_date.advance(1, 'month')
+
+    # Least cloudy scene of the month, null when there is none
+    return sentinel.filterDate(start_date, end_date).sort("CLOUDY_PIXEL_PERCENTAGE").first()
+
+
+def get_catalog(data, mine=None):
+    # One row per scene of the series: source scene id, band prefix in toBands(), date, year and month
+    def compute():
+        columns = get_info(ee.Dictionary({
+            'scene': data.aggregate_array('scene'),
+            'index': data.aggregate_array('system:index'),
+            'date': data.aggregate_array('date'),
+        }), 'get_catalog')
+        return [{'scene': scene, 'index': index, 'date': date, 'year': int(date[:4]), 'month': int(date[5:7])}
+                for scene, index, date in zip(columns['scene'], columns['index'], columns['date'])]
+    if mine is None:
+        return compute()
+    if snapshot_enabled():
+        return snapshot_catalog(mine)
+    if has_cube(mine):
+        return cube_catalog(mine)
+    return cache.get_or_compute(make_key(mine, reducer='catalog'), compute, 'get_catalog', ttl=CATALOG_TTL)
+
+
+def catalog_years(catalog):
+    return sorted({scene['year'] for scene in catalog})
+
 
-    return images_list
+def per_scene(mine, scenes, key, compute_missing, site):
+    # Previously computed scenes come from the cache, only new acquisitions are sent to Earth Engine
+    results = {}
+
+    def lookup(scenes, site=None, count=True):
+        for scene in scenes:
+            value = cache.get(key(scene), site, count=count)
+            if value is not MISSING:
+                results[scene['scene']] = value
+        return [scene for scene in scenes if scene['scene'] not in results]
+
+    def compute(missing):
+        computed = compute_missing(missing)
+        for scene in missing:
+            results[scene['scene']] = computed[scene['scene']]
+            if mine is not None:
+                cache.set(key(scene), computed[scene['scene']])
+
+    if mine is None:
+        compute(scenes)
+        return [results[scene['scene']] for scene in scenes]
+    missing = lookup(scenes, site)
+    if missing:
+        # Another process may be computing the same scenes, once it releases the lock they are in the cache
+        with file_lock([site] + [key(scene) for scene in missing], cache.lock_dir):
+            missing = lookup(missing, count=False)
+            if missing:
+                compute(missing)
+    return [results[scene['scene']] for scene in scenes]
+
+
+def get_dates(index, data, mine=None):
+    return [scene['date'] for scene in get_catalog(data, mine)]
 
-def get_dates(index, data):
-    image_list = ee.ImageCollection(data.select(index)).toList(12)
-    dates = []
-    for i in range(12):
-        image = ee.Image(image_list.get(i))
-        date = image.get('date').getInfo()
-        dates.append(date)
-    return dates
 
 def calc_indices(images, bound):
-    count = images.size().getInfo()
-    return ee.ImageCollection.fromImages(
-        [calculate_indices(ee.Image(images.get(index)).clipToCollection(bound)) for index in range(count)]
-    )
+    # A single mapped function, so the graph sent with every request holds the index expressions once
+    return images.map(lambda image: calculate_indices(ee.Image(image).clip(bound)))
 
 
-def calculate_indices(image):
-    return (
-        calculate_ndvi(image)
-        .addBands(calculate_ndwi1(image))
-        .addBands(calculate_ndwi2(image))
-        .addBands(calculate_nmdi(image))
-        .addBands(calculate_evi(image))
-        .addBands(calculate_msi(image).addBands(calculate_msavi(image)))
-    )
+def mine_bound(mine):
+    return mine_geometry(mine)
+
 
+def build_dataset(mine):
+    return index_series(ee.Geometry.Point(*get_mine(mine)["roi"]), mine_bound(mine), series_windows(mine))
 
-years_fun = [2018, 2019, 2020, 2021, 2022, 2023]
-reducer = ee.Reducer.mean().combine(
-    ee.Reducer.median(), sharedInputs=True).combine(ee.Reducer.mode(), sharedInputs=True)
+
+def index_series(roi, bound, windows):
+    (first_year, first_month), (last_year, last_month) = min(windows), max(windows)
+    # All windows pick from one collection narrowed to the series' time span
+    sentinel = ee.ImageCollection('COPERNICUS/S2_HARMONIZED') \
+        .filterBounds(roi) \
+        .filterDate(ee.Date.fromYMD(first_year, first_month, 1),
+                    ee.Date.fromYMD(last_year, last_month, 1).advance(1, 'month'))
+    images = ee.List(windows).map(
+        lambda window: best_image(sentinel, ee.List(window).get(0), ee.List(window).get(1)), True)
+    return calc_indices(ee.ImageCollection.fromImages(images), bound)
 
 
-def lineplot(index, bound, data, time):
-    stats_data = data.select(index).toBands().reduceRegion(
-        reducer=reducer,
-        geometry=bound,
-        scale=30
-    ).getInfo()
+@st.cache_data(ttl=CATALOG_TTL)
+def get_mine_data(mine):
+    # Each mine is built and memoized on its own, so a page only pays for the mine it shows. The TTL lets
+    # the series pick up months that started since it was built
+    return build_dataset(mine)
 
-    means = [stats_data[f"{i}_{index}_mean"] for i in range(12)]
-    medians = [stats_data[f"{i}_{index}_median"] for i in range(12)]
-    modes = [stats_data[f"{i}_{index}_mode"] for i in range(12)]
+
+def calculate_indices(image):
+    scaled = image.divide(10000)
+    return ee.Image.cat([
+        calculate_ndvi(scaled),
+        calculate_ndwi1(scaled),
+        calculate_ndwi2(scaled),
+        calculate_nmdi(scaled),
+        calculate_evi(scaled),
+        calculate_msi(scaled),
+        calculate_msavi(scaled),
+    ]).set({
+        'date': acquisition_date(image),
+        'scene': image.get('system:index'),
+        'year': ee.Date(image.get('system:time_start')).get('year'),
+    })
+
+
+def stats_reducer():
+    return ee.Reducer.mean().combine(
+        ee.Reducer.median(), sharedInputs=True).combine(ee.Reducer.mode(), sharedInputs=True)
+
+
+indices = ['NDVI', 'EVI', 'NDWI1', 'NDWI2', 'NMDI', 'MSI', 'MSAVI2']
+statistics = ['mean', 'median', 'mode']
+STATS_SCALE = 30
+HIST_SCALE = 40
+# The preview pass reduces a coarser grid and lets Earth Engine sample further if that is still too many pixels
+PREVIEW_STATS_SCALE = 150
+PREVIEW_HIST_SCALE = 200
+PREVIEW_TILE_SCALE = 4
+
+
+# Median and mode from a fixed-bin sketch instead of the exact reducers, always used by the preview pass
+APPROX_STATS = os.environ.get("MINE_APP_APPROX_STATS") == "1"
+
+
+def stats_key(mine, scene, preview=False, approximate=False):
+    from src.sketch import SKETCH_BINS
+    return make_key(mine, image=scene['scene'],
+                    reducer=f'mean+sketch{SKETCH_BINS}' if approximate else 'mean+median+mode',
+                    scale=f"{PREVIEW_STATS_SCALE}:bestEffort" if preview else STATS_SCALE)
+
+
+def sketch_requests(stack, bound, options):
+    # A mean over all bands and, per index, one fixedHistogram with an extra bin on each side that catches the
+    # values outside the index range. Both reducers merge per tile on the server, no pixel list is built
+    from src.sketch import SKETCH_BINS
+    requests = {'mean': stack.reduceRegion(reducer=ee.Reducer.mean(), geometry=bound, **options)}
+    for index in indices:
+        vis_params = get_vis_params(index)
+        width = (vis_params['max'] - vis_params['min']) / SKETCH_BINS
+        requests[index] = stack.select(f".*_{index}").clamp(
+            vis_params['min'] - width / 2, vis_params['max'] + width / 2
+        ).reduceRegion(
+            reducer=ee.Reducer.fixedHistogram(vis_params['min'] - width, vis_params['max'] + width, SKETCH_BINS + 2),
+            geometry=bound,
+            **options
+        )
+    return ee.Dictionary(requests)
+
+
+def get_stats(bound, data, mine=None, preview=False, approximate=None, catalog=None):
+    # One reduction over the bands of every index, so switching the index only redraws the plot
+    approximate = (preview or APPROX_STATS) if approximate is None else approximate
+
+    def exact(scenes, options):
+        subset = data.filter(ee.Filter.inList('scene', [scene['scene'] for scene in scenes]))
+        stats_data = get_info(subset.toBands().reduceRegion(
+            reducer=stats_reducer(),
+            geometry=bound,
+            **options
+        ), site)
+        return {scene['scene']: {index: dict({stat: stats_data.get(f"{scene['index']}_{index}_{stat}")
+                                              for stat in statistics}, error=0.0) for index in indices}
+                for scene in scenes}
+
+    def approximated(scenes, options):
+        from src.sketch import HistogramSketch
+        subset = data.filter(ee.Filter.inList('scene', [scene['scene'] for scene in scenes]))
+        sketches = get_info(sketch_requests(subset.toBands(), bound, options), site)
+        results = {}
+        fallback = []
+        for scene in scenes:
+            results[scene['scene']] = {}
+            for index in indices:
+                band = f"{scene['index']}_{index}"
+                vis_params = get_vis_params(index)
+                sketch = HistogramSketch.from_ee(sketches[index].get(band), vis_params['min'], vis_params['max'],
+                                                 mean=sketches['mean'].get(band))
+                results[scene['scene']][index] = {'mean': sketch.mean(), 'median': sketch.median(),
+                                                  'mode': sketch.mode(), 'error': sketch.error}
+                if sketch.is_exact_needed() and scene not in fallback:
+                    fallback.append(scene)
+        # Scenes whose median or mode falls outside a sketch range get the exact reducers
+        if fallback:
+            results.update(exact(fallback, options))
+        return results
+
+    def compute_missing(scenes):
+        options = dict(scale=PREVIEW_STATS_SCALE, bestEffort=True, tileScale=PREVIEW_TILE_SCALE) if preview \
+            else dict(scale=STATS_SCALE)
+        return (approximated if approximate else exact)(scenes, options)
+    if mine is not None and snapshot_enabled():
+        return snapshot_stats(mine)
+    if mine is not None and has_cube(mine):
+        return cube_stats(mine)
+    site = 'get_stats_preview' if preview else 'get_stats'
+    catalog = get_catalog(data, mine) if catalog is None else catalog
+    scene_stats = per_scene(mine, catalog, lambda scene: stats_key(mine, scene, preview, approximate),
+                            compute_missing, site)
+    return {index: dict({stat: [values[index][stat] for values in scene_stats] for stat in statistics},
+                        error=[values[index].get('error', 0.0) for values in scene_stats]) for index in indices}
+
+
+def lineplot(index, stats, time, key=None):
+    import plotly.graph_objects as go
+    means = stats[index]['mean']
+    medians = stats[index]['median']
+    modes = stats[index]['mode']
+    # Approximate medians and modes carry their error bound, exact ones have none
+    errors = stats[index].get('error')
+    error_y = dict(type='data', array=errors, visible=True) if errors and any(errors) else None
 
     fig = go.Figure()
 
-    for name, values in [('Średnia', means), ('Mediana', medians), ('Moda', modes)]:
-        fig.add_trace(go.Scatter(x=time, y=values, mode='lines+markers', name=name))
+    for name, values, error in [('Średnia', means, None), ('Mediana', medians, error_y), ('Moda', modes, error_y)]:
+        fig.add_trace(go.Scatter(x=time, y=values, mode='lines+markers', name=name, error_y=error))
 
     fig.update_layout(
         title=f'Zmiana statystyk indeksu {index} na przestrzeni lat',
@@ -156,15 +323,14 @@ def lineplot(index, bound, data, time):
         xaxis={'type': 'category'},
     )
 
-    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(fig, use_container_width=True, key=key)
 
 
 palettes_gee = {"NDWI1": 'RdBu', "NDVI": 'RdYlGn', "NMDI": 'YlGnBu', "EVI": 'Greens', 'MSAVI2': 'YlGn', "NDWI2": "gray",
                 "MSI": "RdBu_r"}
-palettes_hist = {"NDWI1": px.colors.diverging.RdBu, "NDVI": px.colors.diverging.RdYlGn,
-                 "NMDI": px.colors.sequential.YlGnBu, "EVI": px.colors.sequential.Greens,
-                 "MSAVI2": px.colors.sequential.YlGn, "NDWI2": px.colors.sequential.gray,
-                 "MSI": px.colors.diverging.RdBu_r}
+# Plotly color scale names, resolved by plotly when a histogram is drawn
+palettes_hist = {"NDWI1": 'RdBu', "NDVI": 'RdYlGn', "NMDI": 'YlGnBu', "EVI": 'Greens', 'MSAVI2': 'YlGn', "NDWI2": "gray",
+                 "MSI": "RdBu_r"}
 text = {
     "NDWI1": '<div style="text-align: justify;">Indeks NDWI (Normalized Difference Water Index) to wskaźnik '
              'teledetekcyjny wykorzystywany do identyfikowania obszarów wody na podstawie danych obrazów '
@@ -268,12 +434,271 @@ def get_vis_params(index):
     return vis_params[index]
 
 
-def get_index(year, index, data):
-    nlcd = data.filter(ee.Filter.Or(
-            ee.Filter.eq("system:index", ims[year][0]),
-            ee.Filter.eq("system:index", ims[year][1])
-        ))
-    return nlcd.select(index)
+def get_scene(scene, index, data):
+    return data.filter(ee.Filter.eq('scene', scene['scene'])).first().select(index)
+
+
+def tile_url(key, image, vis_params):
+    # Map IDs are memoized, so switching back to a year or index reuses the tile URL template
+    def compute():
+        return timed('getMapId', lambda: ee.Image(image).getMapId(vis_params)['tile_fetcher'].url_format)
+    return tile_cache.get_or_compute(key, compute, 'getMapId')
+
+
+def index_tile_url(mine, scene, index, data):
+    from geemap.coreutils import check_cmap
+    vis_params = get_vis_params(index)
+    vis_params = dict(vis_params, palette=check_cmap(vis_params['palette']))
+    key = make_key(mine, index, scene['year'], scene['scene'], f"getMapId:{json.dumps(vis_params, sort_keys=True)}")
+    return tile_url(key, get_scene(scene, index, data), vis_params)
+
+
+def polygon_tile_url(mine, bound):
+    # Same styling geemap's addLayer applies to a FeatureCollection
+    bound = ee.FeatureCollection([ee.Feature(bound)])
+    outline = bound.style(color='000000', fillColor='00000000', width=2)
+    image = bound.style(fillColor='000000').updateMask(ee.Image.constant(0.5)).blend(outline)
+    return tile_url(make_key(mine, reducer='getMapId:polygon'), image, {})
+
+
+def common_windows(mines):
+    windows = [series_windows(mine) for mine in mines]
+    return [window for window in windows[0] if all(window in other for other in windows[1:])]
+
+
+def clip_image(image, bound):
+    # best_image is null for a window without a scene, it stays null so removeAll can drop it
+    return ee.Algorithms.If(image, ee.Image(image).clip(bound), None)
+
+
+def comparison_stack(mines, windows):
+    # Every window mosaics the least cloudy scene of each mine, so one image per window covers all mines and the
+    # toBands prefixes follow the window positions. Each scene is clipped to its own mine first, otherwise a mine
+    # sharing a granule with another would be reduced over whichever scene the mosaic put on top
+    rois = [ee.Geometry.Point(*get_mine(mine)["roi"]) for mine in mines]
+    bounds = [mine_bound(mine) for mine in mines]
+    (first_year, first_month), (last_year, last_month) = min(windows), max(windows)
+    sentinel = ee.ImageCollection('COPERNICUS/S2_HARMONIZED') \
+        .filterBounds(ee.Geometry.MultiPoint([get_mine(mine)["roi"] for mine in mines])) \
+        .filterDate(ee.Date.fromYMD(first_year, first_month, 1),
+                    ee.Date.fromYMD(last_year, last_month, 1).advance(1, 'month'))
+
+    def window_image(window):
+        window = ee.List(window)
+        images = ee.List([clip_image(best_image(sentinel.filterBounds(roi), window.get(0), window.get(1)), bound)
+                          for roi, bound in zip(rois, bounds)])
+        return ee.ImageCollection.fromImages(images.removeAll([None])).map(calculate_indices).mosaic()
+    return ee.ImageCollection.fromImages(ee.List(windows).map(window_image)).toBands()
+
+
+def comparable_mines(mines):
+    # In snapshot mode only the mines the last precompute run stored can be compared
+    return [mine for mine in mines if in_snapshot(mine)] if snapshot_enabled() else list(mines)
+
+
+def get_comparison(mines):
+    # Statistics of every mine, index and window from a single reduceRegions over all mine polygons
+    mines = comparable_mines(mines)
+    if not mines:
+        return [], {}
+    windows = common_windows(mines)
+
+    def compute():
+        features = ee.FeatureCollection([ee.Feature(mine_bound(mine), {'mine': mine}) for mine in mines])
+        reduced = comparison_stack(mines, windows).reduceRegions(
+            collection=features,
+            reducer=stats_reducer(),
+            scale=STATS_SCALE
+        ).map(lambda feature: feature.setGeometry(None))
+        rows = {feature['properties']['mine']: feature['properties']
+                for feature in get_info(reduced, 'get_comparison')['features']}
+        return {mine: {index: {stat: [rows[mine].get(f"{position}_{index}_{stat}") for position in range(len(windows))]
+                               for stat in statistics} for index in indices} for mine in mines}
+
+    def from_local():
+        # Snapshots and cubes hold each mine's own scenes, they are lined up by (year, month)
+        comparison = {}
+        for mine in mines:
+            positions = {(scene['year'], scene['month']): i for i, scene in enumerate(get_catalog(None, mine))}
+            stats = get_stats(None, None, mine=mine)
+            comparison[mine] = {index: {stat: [stats[index][stat][positions[tuple(window)]]
+                                               if tuple(window) in positions else None for window in windows]
+                                        for stat in statistics} for index in indices}
+        return comparison
+    if snapshot_enabled() or all(has_cube(mine) for mine in mines):
+        return windows, from_local()
+    key = make_key(sorted(mines), reducer='compare:mean+median+mode', image=windows[-1] if windows else None,
+                   scale=STATS_SCALE)
+    return windows, cache.get_or_compute(key, compute, 'get_comparison', ttl=CATALOG_TTL)
+
+
+def compareplot(index, stat, comparison, windows, names):
+    import plotly.graph_objects as go
+    fig = go.Figure()
+    labels = [f"{year}-{month:02d}" for year, month in windows]
+    for mine, stats in comparison.items():
+        fig.add_trace(go.Scatter(x=labels, y=stats[index][stat], mode='lines+markers', name=names[mine]))
+
+    fig.update_layout(
+        title=f'Porównanie indeksu {index} między kopalniami',
+        xaxis_title="Okres",
+        yaxis_title='Wartość',
+        showlegend=True,
+        height=500,
+        xaxis={'type': 'category'},
+    )
+
+    st.plotly_chart(fig, use_container_width=True)
+
+
+# Clicks are rounded to about 10 m, a Sentinel-2 pixel, so clicking near an earlier point reuses its series
+PIXEL_PRECISION = 4
+PIXEL_SCALE = 10
+PIXEL_CACHE_SIZE = 128
+_pixel_caches = collections.defaultdict(collections.OrderedDict)
+_pixel_lock = threading.Lock()
+
+
+def fetch_pixel_series(mine, lon, lat, data):
+    # One getRegion over the whole collection returns the pixel's values of every index for every scene
+    def compute():
+        rows = get_info(data.select(indices).getRegion(ee.Geometry.Point(lon, lat), PIXEL_SCALE), 'pixel_series')
+        header = rows[0]
+        by_index = {row[header.index('id')]: dict(zip(header, row)) for row in rows[1:]}
+        series = {'date': [scene['date'] for scene in catalog]}
+        for index in indices:
+            series[index] = [by_index.get(scene['index'], {}).get(index) for scene in catalog]
+        return series
+    if has_cube(mine):
+        return cube_pixel_series(mine, lon, lat)
+    if snapshot_enabled():
+        return None
+    # The last scene in the key makes a refreshed catalog with new acquisitions fetch the series again
+    catalog = get_catalog(data, mine)
+    last_scene = catalog[-1]['scene'] if catalog else None
+    key = make_key(mine, image=f"pixel:{lon},{lat}:{last_scene}", reducer='getRegion', scale=PIXEL_SCALE)
+    return cache.get_or_compute(key, compute, 'pixel_series', ttl=CATALOG_TTL)
+
+
+def pixel_series(mine, lon, lat, data):
+    # A small in-memory LRU per mine in front of the shared result cache, keyed like it on the catalog's last
+    # scene so points clicked before a catalog refresh pick up the new scenes
+    catalog = get_catalog(data, mine)
+    key = round(lon, PIXEL_PRECISION), round(lat, PIXEL_PRECISION), catalog[-1]['scene'] if catalog else None
+    with _pixel_lock:
+        mine_cache = _pixel_caches[mine]
+        if key in mine_cache:
+            mine_cache.move_to_end(key)
+            return mine_cache[key]
+    series = fetch_pixel_series(mine, *key[:2], data)
+    if series is None:
+        return None
+    with _pixel_lock:
+        mine_cache[key] = series
+        if len(mine_cache) > PIXEL_CACHE_SIZE:
+            mine_cache.popitem(last=False)
+    return series
+
+
+def pixel_plot(series, lat, lon, key=None):
+    import plotly.graph_objects as go
+    fig = go.Figure()
+
+    for index in indices:
+        fig.add_trace(go.Scatter(x=series['date'], y=series[index], mode='lines+markers', name=index))
+
+    fig.update_layout(
+        title=f'Wartości wskaźników w punkcie {lat:.4f}, {lon:.4f}',
+        xaxis_title="Data",
+        yaxis_title='Wartość',
+        showlegend=True,
+        height=350,
+        xaxis={'type': 'category'},
+    )
+
+    st.plotly_chart(fig, use_container_width=True, key=key)
+
+
+TREND_P_VALUE = 0.05
+TREND_BANDS = ['slope', 'offset', 'correlation', 'p_value', 'year_sum', 'year_count', 'previous_sum', 'previous_count']
+
+
+def trend_image(index, year, data):
+    # One temporal reduction over the whole series: least squares fit of the index against time in years,
+    # Pearson's correlation for R² and significance, and sums for the year-over-year delta
+    origin = ee.Date.fromYMD(DEFAULT_SERIES["start_year"], 1, 1)
+
+    def prepare(image):
+        value = image.select(index)
+        mask = value.mask()
+        image_year = ee.Number(image.get('year'))
+        this_year = ee.Image.constant(image_year.eq(year)).updateMask(mask)
+        previous_year = ee.Image.constant(image_year.eq(year - 1)).updateMask(mask)
+        return ee.Image.cat([
+            ee.Image.constant(ee.Date(image.get('date')).difference(origin, 'year')).updateMask(mask),
+            value,
+            value.multiply(this_year),
+            this_year,
+            value.multiply(previous_year),
+            previous_year,
+        ]).float().rename(['t', 'value', 'year_value', 'year_count', 'previous_value', 'previous_count'])
+
+    reducer = ee.Reducer.linearFit().combine(ee.Reducer.pearsonsCorrelation(), sharedInputs=True).combine(
+        ee.Reducer.sum().forEach(['year_sum', 'year_count', 'previous_sum', 'previous_count']), sharedInputs=False)
+    reduced = data.map(prepare).reduce(reducer).rename(TREND_BANDS)
+    return ee.Image.cat([
+        reduced.select('slope'),
+        reduced.select('correlation').pow(2).rename('r2'),
+        reduced.select('year_sum').divide(reduced.select('year_count')).subtract(
+            reduced.select('previous_sum').divide(reduced.select('previous_count'))).rename('delta'),
+        reduced.select('p_value').lt(TREND_P_VALUE).rename('significant'),
+    ])
+
+
+def trend_key(mine, index, year, catalog, reducer):
+    # The trend covers the whole series, so the key changes whenever a scene is added
+    return make_key(mine, index, year, catalog[-1]['scene'] if catalog else None, f"{reducer}:{len(catalog)}")
+
+
+def change_area(mine, index, year, data, bound, catalog):
+    # Hectares of significant increase and decrease inside the mine polygon, in a single reduceRegion
+    def compute():
+        trend = trend_image(index, year, data)
+        slope = trend.select('slope')
+        significant = trend.select('significant')
+        area = ee.Image.pixelArea().divide(10000)
+        areas = ee.Image.cat([
+            area.updateMask(significant.And(slope.gt(0))).rename('increase'),
+            area.updateMask(significant.And(slope.lt(0))).rename('decrease'),
+            area.updateMask(slope.mask()).rename('total'),
+        ])
+        return get_info(areas.reduceRegion(
+            reducer=ee.Reducer.sum(),
+            geometry=bound,
+            scale=STATS_SCALE
+        ), 'change_area')
+    return cache.get_or_compute(trend_key(mine, index, year, catalog, 'change_area'), compute, 'change_area')
+
+
+def trend_tile_urls(mine, index, year, data, catalog):
+    from geemap.coreutils import check_cmap
+    trend = trend_image(index, year, data)
+    vis_params = get_vis_params(index)
+    span = vis_params['max'] - vis_params['min']
+    layers = [
+        (f"Trend {index} [1/rok]", trend.select('slope'), {'min': -span / 10, 'max': span / 10, 'palette': 'RdBu'}),
+        (f"R² trendu {index}", trend.select('r2'), {'min': 0, 'max': 1, 'palette': 'viridis'}),
+        (f"Zmiana {index} {year - 1}–{year}", trend.select('delta'), {'min': -span / 4, 'max': span / 4,
+                                                                       'palette': 'RdBu'}),
+        (f"Istotny trend {index}", trend.select('slope').gt(0).updateMask(trend.select('significant')),
+         {'min': 0, 'max': 1, 'palette': 'RdYlGn'}),
+    ]
+    urls = []
+    for name, image, layer_vis in layers:
+        layer_vis = dict(layer_vis, palette=check_cmap(layer_vis['palette']))
+        key = trend_key(mine, index, year, catalog, f"getMapId:{name}:{json.dumps(layer_vis, sort_keys=True)}")
+        urls.append((name, tile_url(key, image, layer_vis)))
+    return urls
 
 
 def latest_image(roi):
@@ -285,18 +710,55 @@ def latest_image(roi):
     return image
 
 
-def plot_hist(year, index, data, number):
-    x = ee.Image(get_index(year, index, data).toList(2).get(number))
-    values = x.reduceRegion(
-        reducer=ee.Reducer.toList(),
-        geometry=x.geometry(),
-        scale=40
-    ).getInfo()[index]
-
-    BINS = 20
-    y, x = np.histogram(values, bins=BINS)
-    x = [(a + b) / 2 for a, b in zip(x, x[1:])]
+HIST_BINS = 20
+
+
+def hist_key(mine, index, year, scene, preview=False):
+    return make_key(mine, index, year, scene['scene'], f'fixedHistogram{HIST_BINS}',
+                    f"{PREVIEW_HIST_SCALE}:bestEffort" if preview else HIST_SCALE)
+
+
+def get_hists(year, index, data, mine=None, preview=False):
+    # Histograms of all scenes of the year are binned on the server and fetched together
+    def compute_missing(scenes):
+        vis_params = get_vis_params(index)
+        options = dict(scale=PREVIEW_HIST_SCALE, bestEffort=True, tileScale=PREVIEW_TILE_SCALE) if preview \
+            else dict(scale=HIST_SCALE)
+        hists = {}
+        bound = mine_bound(mine) if mine is not None else None
+        for scene in scenes:
+            x = get_scene(scene, index, data)
+            hists[scene['scene']] = x.reduceRegion(
+                reducer=ee.Reducer.fixedHistogram(vis_params['min'], vis_params['max'], HIST_BINS),
+                geometry=x.geometry() if bound is None else bound,
+                **options
+            ).get(index)
+        return get_info(ee.Dictionary(hists), site)
+    if mine is not None and snapshot_enabled():
+        return snapshot_hists(mine, year, index)
+    if mine is not None and has_cube(mine):
+        return cube_hists(mine, year, index)
+    site = 'get_hists_preview' if preview else 'get_hists'
+    scenes = [scene for scene in get_catalog(data, mine) if scene['year'] == year]
+    return per_scene(mine, scenes, lambda scene: hist_key(mine, index, year, scene, preview), compute_missing, site)
+
+
+def full_results_cached(mine, catalog, year, index):
+    # When the full-resolution results are already at hand the preview pass would only cost a round trip
+    if snapshot_enabled() or has_cube(mine):
+        return True
+    return all(cache.has(stats_key(mine, scene, approximate=APPROX_STATS)) for scene in catalog) and \
+        all(cache.has(hist_key(mine, index, year, scene)) for scene in catalog if scene['year'] == year)
+
+
+def plot_hist(index, hist, key=None):
+    import plotly.express as px
+    vis_params = get_vis_params(index)
+    width = (vis_params['max'] - vis_params['min']) / HIST_BINS
+    hist = hist or []
+    x = [bucket_min + width / 2 for bucket_min, _ in hist]
+    y = [count for _, count in hist]
     fig = px.bar(x=x, y=y, color=x, color_continuous_scale=palettes_hist[index]
                  ).update_layout(title=f'Histogram rozkładu wartości {index}', xaxis_title='Wartość',
                                  yaxis_title='Ilość wystąpień')
-    st.plotly_chart(fig, use_container_width=True, height=400)
+    st.plotly_chart(fig, use_container_width=True, height=400, key=key)
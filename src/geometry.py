@@ -0,0 +1,110 @@
+import argparse
+import functools
+import json
+import logging
+import os
+
+import ee
+
+from src.cache import CACHE_DIR
+from src.metrics import get_info
+from src.registry import get_mine, load_registry
+from src.singleflight import file_lock
+
+GLOBAL_MINING = "projects/sat-io/open-datasets/global-mining/global_mining_polygons"
+GEOMETRY_DIR = os.environ.get("MINE_APP_GEOMETRY_DIR", os.path.join(CACHE_DIR, "geometries"))
+# Metres, a Sentinel-2 pixel, so the simplified outline clips and reduces to the same pixels within one pixel
+SIMPLIFY_TOLERANCE = 10
+
+logger = logging.getLogger(__name__)
+
+
+def mine_filter(spec):
+    if "in" in spec:
+        return ee.Filter.inList(spec["property"], spec["in"])
+    return ee.Filter.eq(spec["property"], spec["equals"])
+
+
+def mine_polygons(mine):
+    return ee.FeatureCollection(GLOBAL_MINING).filter(mine_filter(get_mine(mine)["filter"]))
+
+
+def geometry_path(mine, simplified=True):
+    return os.path.join(GEOMETRY_DIR, f"{mine}.simplified.geojson" if simplified else f"{mine}.geojson")
+
+
+def _write(path, mine, geometry, tolerance):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({'type': 'Feature', 'geometry': geometry, 'properties': {'mine': mine, 'tolerance': tolerance}}, f)
+    os.replace(tmp_path, path)
+
+
+def resolve_geometry(mine):
+    # The only query that filters the global collection, the dissolved outline and its simplified version come
+    # back in one request and are written as GeoJSON next to the cache
+    path = geometry_path(mine)
+    with file_lock(['geometry', mine], os.path.join(GEOMETRY_DIR, "locks")):
+        if os.path.exists(path):
+            return
+        outline = mine_polygons(mine).geometry()
+        result = get_info(ee.Dictionary({'geometry': outline, 'simplified': outline.simplify(SIMPLIFY_TOLERANCE)}),
+                          'mine_geometry')
+        _write(geometry_path(mine, simplified=False), mine, result['geometry'], 0)
+        _write(path, mine, result['simplified'], SIMPLIFY_TOLERANCE)
+
+
+@functools.lru_cache(maxsize=None)
+def load_geometry(mine, simplified=True):
+    path = geometry_path(mine, simplified)
+    if not os.path.exists(path):
+        resolve_geometry(mine)
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)['geometry']
+
+
+def mine_geometry(mine, simplified=True):
+    # A literal geometry, so requests carry the outline instead of a filter over the global collection
+    return ee.Geometry(load_geometry(mine, simplified))
+
+
+def geometry_bounds(mine):
+    # The bounding box as a GeoJSON polygon, computed locally from the stored outline
+    coordinates = []
+
+    def collect(value):
+        if value and isinstance(value[0], (int, float)):
+            coordinates.append(value)
+        else:
+            for item in value:
+                collect(item)
+    geometry = load_geometry(mine, simplified=False)
+    for part in geometry.get('geometries', [geometry]):
+        collect(part['coordinates'])
+    lons, lats = [lon for lon, _ in coordinates], [lat for _, lat in coordinates]
+    return {'type': 'Polygon', 'coordinates': [[[min(lons), min(lats)], [max(lons), min(lats)],
+                                                [max(lons), max(lats)], [min(lons), max(lats)],
+                                                [min(lons), min(lats)]]]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resolve mine outlines into local GeoJSON")
+    parser.add_argument("--mine", action="append", help="limit to the given mines, may be repeated")
+    parser.add_argument("--refresh", action="store_true", help="resolve again even if the GeoJSON exists")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    from src.earth_engine import ensure_initialized
+    ensure_initialized()
+    for mine in args.mine or load_registry():
+        if args.refresh:
+            for simplified in (True, False):
+                if os.path.exists(geometry_path(mine, simplified)):
+                    os.remove(geometry_path(mine, simplified))
+            load_geometry.cache_clear()
+        load_geometry(mine)
+        logger.info("%s: %s", mine, geometry_path(mine))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import numpy as np
+
+BANDS = ('B2', 'B3', 'B4', 'B8', 'B8A', 'B11', 'B12')
+# Same band order as calculate_indices produces on Earth Engine
+INDICES = ('NDVI', 'NDWI1', 'NDWI2', 'NMDI', 'EVI', 'MSI', 'MSAVI2')
+SCALE = np.float32(10000)
+
+
+def compute_indices(bands, out=None):
+    # bands maps Sentinel-2 band names to arrays of raw digital numbers, out is a (7, *shape) float32 array.
+    # The normalized differences and MSI do not depend on the 1/10000 reflectance scale, so everything is
+    # computed on the digital numbers, which float32 holds exactly, and the scale enters only as the constant
+    # term of EVI and MSAVI2.
+    shape = np.shape(bands['B8'])
+    if out is None:
+        out = np.empty((len(INDICES),) + shape, dtype=np.float32)
+    blue, green, red, nir, nir_narrow, swir1, swir2 = (np.asarray(bands[name], dtype=np.float32) for name in BANDS)
+    ndvi, ndwi1, ndwi2, nmdi, evi, msi, msavi2 = out
+
+    nir_red_sum = nir + red
+    nir_red_diff = nir - red
+    swir_diff = swir1 - swir2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(nir_red_diff, nir_red_sum, out=ndvi)
+        np.divide(nir_narrow - swir2, nir_narrow + swir2, out=ndwi1)
+        np.divide(green - nir, nir + green, out=ndwi2)
+        np.divide(nir_narrow - swir_diff, nir_narrow + swir_diff, out=nmdi)
+        # NIR + 6 * RED - 7.5 * BLUE + 1 rewritten on top of the shared NIR + RED sum
+        np.divide(2.5 * nir_red_diff, nir_red_sum + 5 * red - 7.5 * blue + SCALE, out=evi)
+        np.divide(swir1, nir_narrow, out=msi)
+        # (2NIR + 1 - sqrt((2NIR + 1)^2 - 8(NIR - RED))) / 2 without the cancellation between the two terms,
+        # the radicand equals (2NIR - 1)^2 + 8RED and is never negative
+        radicand = 2 * nir - SCALE
+        radicand *= radicand
+        radicand += 8 * SCALE * red
+        np.sqrt(radicand, out=msavi2)
+        msavi2 += 2 * nir + SCALE
+        np.divide(4 * nir_red_diff, msavi2, out=msavi2)
+    # Earth Engine masks divisions by zero, locally they become NaN
+    out[~np.isfinite(out)] = np.nan
+    return out
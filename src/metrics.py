@@ -0,0 +1,140 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+METRICS_PATH = os.environ.get("MINE_APP_METRICS")
+# Reruns happen on every widget change, the file is rewritten at most this often
+EXPORT_INTERVAL = 15
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+_rerun_events = contextvars.ContextVar("rerun_events", default=None)
+_lock = threading.Lock()
+_requests = defaultdict(int)
+_bytes = defaultdict(int)
+_latency_sum = defaultdict(float)
+_latency_buckets = defaultdict(lambda: [0] * len(LATENCY_BUCKETS))
+_cache_lookups = defaultdict(int)
+_exported = {}
+
+logger = logging.getLogger(__name__)
+
+
+def start_rerun():
+    # Events recorded in this context, including executor threads started from it, land in the returned list
+    events = []
+    _rerun_events.set(events)
+    return events
+
+
+def _record(event):
+    events = _rerun_events.get()
+    if events is not None:
+        events.append(event)
+
+
+def record_request(site, latency, payload_bytes):
+    with _lock:
+        _requests[site] += 1
+        _bytes[site] += payload_bytes
+        _latency_sum[site] += latency
+        buckets = _latency_buckets[site]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                buckets[i] += 1
+                break
+    _record({"site": site, "kind": "request", "latency": latency, "bytes": payload_bytes})
+
+
+def record_cache(site, hit):
+    with _lock:
+        _cache_lookups[site, hit] += 1
+    _record({"site": site, "kind": "hit" if hit else "miss", "latency": 0.0, "bytes": 0})
+
+
+def get_info(ee_object, site):
+    # Identical graphs requested at the same time, e.g. by several sessions opening one mine, share one request
+    from src.singleflight import flights, graph_key
+
+    def request():
+        start = time.perf_counter()
+        result = ee_object.getInfo()
+        record_request(site, time.perf_counter() - start, len(json.dumps(result)))
+        return result
+    return flights.do(graph_key(ee_object, site), request)
+
+
+def timed(site, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    record_request(site, time.perf_counter() - start, len(json.dumps(result)))
+    return result
+
+
+def summarize(events):
+    summary = {}
+    for event in events:
+        row = summary.setdefault(event["site"], {"miejsce": event["site"], "zapytania": 0, "czas [s]": 0.0,
+                                                 "bajty": 0, "trafienia": 0, "chybienia": 0})
+        if event["kind"] == "request":
+            row["zapytania"] += 1
+            row["czas [s]"] += event["latency"]
+            row["bajty"] += event["bytes"]
+        else:
+            row["trafienia" if event["kind"] == "hit" else "chybienia"] += 1
+    return list(summary.values())
+
+
+def show_panel(events):
+    import streamlit as st
+    rows = summarize(events)
+    total = sum(row["czas [s]"] for row in rows)
+    with st.sidebar.expander(f"Zapytania Earth Engine ({sum(row['zapytania'] for row in rows)}, {total:.2f} s)"):
+        st.dataframe(rows, hide_index=True)
+
+
+def prometheus_text():
+    with _lock:
+        sites = sorted(_requests)
+        lines = ["# TYPE ee_requests_total counter"]
+        lines += [f'ee_requests_total{{site="{site}"}} {_requests[site]}' for site in sites]
+        lines.append("# TYPE ee_response_bytes_total counter")
+        lines += [f'ee_response_bytes_total{{site="{site}"}} {_bytes[site]}' for site in sites]
+        lines.append("# TYPE ee_request_latency_seconds histogram")
+        for site in sites:
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, _latency_buckets[site]):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else bound
+                lines.append(f'ee_request_latency_seconds_bucket{{site="{site}",le="{le}"}} {cumulative}')
+            lines.append(f'ee_request_latency_seconds_sum{{site="{site}"}} {_latency_sum[site]}')
+            lines.append(f'ee_request_latency_seconds_count{{site="{site}"}} {_requests[site]}')
+        lines.append("# TYPE ee_cache_lookups_total counter")
+        for (site, hit), count in sorted(_cache_lookups.items()):
+            result = "hit" if hit else "miss"
+            lines.append(f'ee_cache_lookups_total{{site="{site}",result="{result}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+def export(path=None, interval=EXPORT_INTERVAL):
+    # Only with MINE_APP_METRICS set, so a read-only deployment writes nothing. A failed write is logged and
+    # never takes the page down
+    path = path or METRICS_PATH
+    if not path:
+        return
+    now = time.monotonic()
+    with _lock:
+        if now - _exported.get(path, -interval) < interval:
+            return
+        _exported[path] = now
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(prometheus_text())
+        os.replace(tmp_path, path)
+    except OSError as error:
+        logger.warning("could not export metrics to %s: %s", path, error)
@@ -0,0 +1,58 @@
+import argparse
+import logging
+
+from src import snapshot as snapshot_mode
+from src.earth_engine import initialize
+from src.executor import gather, submit
+from src.funcs import build_dataset, catalog_years, get_catalog, get_hists, get_stats, indices, mine_bound
+from src.registry import load_registry
+from src.snapshot import is_fresh, load_snapshot, mine_arrays, pack_mine, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def precompute_mine(mine):
+    # Goes through the per-scene result cache, so a refresh only computes acquisitions added since the last run
+    data = build_dataset(mine)
+    catalog = get_catalog(data, mine)
+    stats_future = submit(get_stats, mine_bound(mine), data, mine=mine)
+    hists_futures = {(year, index): submit(get_hists, year, index, data, mine=mine)
+                     for year in catalog_years(catalog) for index in indices}
+    stats, = gather(stats_future)
+    hists = {scene['scene']: {} for scene in catalog}
+    for (year, index), year_hists in zip(hists_futures, gather(*hists_futures.values())):
+        scenes = [scene for scene in catalog if scene['year'] == year]
+        for scene, hist in zip(scenes, year_hists):
+            hists[scene['scene']][index] = hist
+    return pack_mine(mine, catalog, stats, hists)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Materialize mine statistics into a local snapshot file")
+    parser.add_argument("--output", default="snapshot.npz")
+    parser.add_argument("--max-age", type=float, default=7 * 24 * 3600,
+                        help="seconds after which a mine's entries are recomputed")
+    parser.add_argument("--mine", action="append",
+                        help="limit the refresh to the given mines, may be repeated")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    # The job computes what the snapshot serves, so it never reads from one, even with MINE_APP_SNAPSHOT set
+    snapshot_mode.SNAPSHOT_PATH = None
+    initialize()
+    snapshot = dict(load_snapshot(args.output))
+    for mine in args.mine or load_registry():
+        if is_fresh(snapshot, mine, args.max_age):
+            logger.info("%s is fresh, skipping", mine)
+            continue
+        logger.info("computing %s", mine)
+        for key in mine_arrays(snapshot, mine):
+            del snapshot[key]
+        snapshot.update(precompute_mine(mine))
+        # Written after every mine so an interrupted run keeps what it already computed
+        write_snapshot(args.output, snapshot)
+    logger.info("snapshot written to %s", args.output)
+
+
+if __name__ == "__main__":
+    main()
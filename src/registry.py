@@ -0,0 +1,16 @@
+import functools
+import json
+import os
+
+REGISTRY_PATH = os.environ.get("MINE_APP_REGISTRY", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                  "mines.json"))
+
+
+@functools.lru_cache(maxsize=None)
+def load_registry(path=REGISTRY_PATH):
+    with open(path, encoding="utf-8") as f:
+        return {mine["id"]: mine for mine in json.load(f)}
+
+
+def get_mine(mine_id):
+    return load_registry()[mine_id]
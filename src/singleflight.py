@@ -0,0 +1,78 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Keys are hashed onto a fixed set of lock files, so the lock directory does not grow with every new key. Two
+# keys sharing a file only serialize each other, which is why locks of one directory are never nested
+LOCK_FILES = 64
+
+
+def digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def graph_key(ee_object, *params):
+    # Two requests with the same serialized graph and parameters compute the same thing
+    return digest(ee_object.serialize(), *params)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share one execution, the first caller runs it and the others wait
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+flights = SingleFlight()
+
+
+@contextlib.contextmanager
+def file_lock(key, lock_dir):
+    # Serializes processes sharing the cache directory, the holder computes and the others find its result
+    # in the cache once they get the lock. Without fcntl only the in-process coalescing applies
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, f"{int(digest(key), 16) % LOCK_FILES}.lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
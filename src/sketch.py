@@ -0,0 +1,86 @@
+import numpy as np
+
+SKETCH_BINS = 200
+
+
+class HistogramSketch:
+    # Fixed-bin counts over [low, high) plus one outer bin on each side for the values outside the range.
+    # Sketches of the same range merge by adding counts, so tiles, chunks or scenes can be summarized apart and
+    # combined without keeping their pixels. Quantiles and the mode are within one bin width of the exact values
+    # while they fall inside the range; outside it they are unknown and is_exact_needed says so
+    def __init__(self, low, high, bins=SKETCH_BINS, counts=None, total=0.0):
+        self.low = low
+        self.high = high
+        self.bins = bins
+        self.counts = np.zeros(bins + 2, dtype=np.float64) if counts is None else np.asarray(counts, dtype=np.float64)
+        self.total = total
+        if self.counts.shape != (bins + 2,):
+            raise ValueError(f"expected {bins + 2} counts, got {self.counts.shape}")
+
+    @property
+    def width(self):
+        return (self.high - self.low) / self.bins
+
+    @property
+    def error(self):
+        return self.width
+
+    @property
+    def count(self):
+        return float(self.counts.sum())
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        positions = np.floor((values - self.low) / self.width).astype(np.int64) + 1
+        np.clip(positions, 0, self.bins + 1, out=positions)
+        self.counts += np.bincount(positions, minlength=self.bins + 2)
+        self.total += float(values.sum())
+        return self
+
+    def merge(self, other):
+        if (other.low, other.high, other.bins) != (self.low, self.high, self.bins):
+            raise ValueError("only sketches with the same range and bins can be merged")
+        return HistogramSketch(self.low, self.high, self.bins, self.counts + other.counts, self.total + other.total)
+
+    def center(self, position):
+        return self.low + (position - 0.5) * self.width
+
+    def quantile_bin(self, q):
+        return int(np.searchsorted(np.cumsum(self.counts), q * self.count))
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        return self.center(min(max(self.quantile_bin(q), 1), self.bins))
+
+    def median(self):
+        return self.quantile(0.5)
+
+    def mode(self):
+        if not self.count:
+            return None
+        return self.center(int(np.argmax(self.counts[1:-1])) + 1)
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def is_exact_needed(self):
+        # The median or the fullest bin outside the range cannot be placed within one bin width
+        if not self.count:
+            return False
+        outer = {0, self.bins + 1}
+        return self.quantile_bin(0.5) in outer or int(np.argmax(self.counts)) in outer
+
+    def coarsen(self, bins):
+        # Counts of the inner range regrouped into fewer equal bins, e.g. for the 20 bin histograms
+        return self.counts[1:-1].reshape(bins, -1).sum(axis=1)
+
+    @classmethod
+    def from_ee(cls, rows, low, high, bins=SKETCH_BINS, mean=None):
+        # rows are Earth Engine fixedHistogram rows over the range widened by one bin on each side
+        sketch = cls(low, high, bins, [count for _, count in rows or []] or None)
+        if mean is not None:
+            sketch.total = mean * sketch.count
+        return sketch
+
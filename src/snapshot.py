@@ -0,0 +1,99 @@
+import functools
+import os
+import time
+
+SNAPSHOT_PATH = os.environ.get("MINE_APP_SNAPSHOT")
+
+
+class NotInSnapshot(LookupError):
+    # The mine was added after the last precompute run, or left out of it with --mine
+    def __init__(self, mine):
+        super().__init__(f"{mine} is not in the snapshot, run python -m src.precompute --mine {mine}")
+        self.mine = mine
+
+
+def snapshot_enabled():
+    return bool(SNAPSHOT_PATH)
+
+
+@functools.lru_cache(maxsize=4)
+def _read(path, mtime):
+    import numpy as np
+    with np.load(path) as npz:
+        return {key: npz[key] for key in npz.files}
+
+
+def load_snapshot(path=None):
+    path = path or SNAPSHOT_PATH
+    if not path or not os.path.exists(path):
+        return {}
+    return _read(path, os.path.getmtime(path))
+
+
+def write_snapshot(path, arrays):
+    import numpy as np
+    tmp_path = f"{path}.tmp.npz"
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def mine_arrays(snapshot, mine):
+    prefix = f"{mine}."
+    return {key: value for key, value in snapshot.items() if key.startswith(prefix)}
+
+
+def is_fresh(snapshot, mine, max_age):
+    computed_at = snapshot.get(f"{mine}.computed_at")
+    return computed_at is not None and time.time() - float(computed_at) < max_age
+
+
+def pack_mine(mine, catalog, stats, hists):
+    # hists is {scene: {index: fixedHistogram rows}}, only the counts are stored
+    import numpy as np
+    from src.funcs import indices, statistics, HIST_BINS
+    stats_array = np.array([[[np.nan if value is None else value for value in stats[index][stat]]
+                             for stat in statistics] for index in indices], dtype=np.float64)
+    hists_array = np.zeros((len(catalog), len(indices), HIST_BINS), dtype=np.int32)
+    for i, scene in enumerate(catalog):
+        for j, index in enumerate(indices):
+            for k, (_, count) in enumerate(hists[scene['scene']][index] or []):
+                hists_array[i, j, k] = count
+    arrays = {f"{mine}.{column}": np.array([scene[column] for scene in catalog])
+              for column in ('scene', 'index', 'date', 'year', 'month')}
+    arrays.update({f"{mine}.stats": stats_array, f"{mine}.hists": hists_array,
+                   f"{mine}.computed_at": np.array(time.time())})
+    return arrays
+
+
+def in_snapshot(mine):
+    return f"{mine}.computed_at" in load_snapshot()
+
+
+def _mine_snapshot(mine):
+    snapshot = load_snapshot()
+    if f"{mine}.computed_at" not in snapshot:
+        raise NotInSnapshot(mine)
+    return snapshot
+
+
+def snapshot_catalog(mine):
+    snapshot = _mine_snapshot(mine)
+    columns = {column: snapshot[f"{mine}.{column}"].tolist() for column in ('scene', 'index', 'date', 'year', 'month')}
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+def snapshot_stats(mine):
+    import numpy as np
+    from src.funcs import indices, statistics
+    stats_array = _mine_snapshot(mine)[f"{mine}.stats"]
+    return {index: {stat: [None if np.isnan(value) else float(value) for value in stats_array[i, j]]
+                    for j, stat in enumerate(statistics)} for i, index in enumerate(indices)}
+
+
+def snapshot_hists(mine, year, index):
+    from src.funcs import indices, HIST_BINS, get_vis_params
+    snapshot = _mine_snapshot(mine)
+    counts = snapshot[f"{mine}.hists"][snapshot[f"{mine}.year"] == year, indices.index(index)]
+    vis_params = get_vis_params(index)
+    width = (vis_params['max'] - vis_params['min']) / HIST_BINS
+    return [[[vis_params['min'] + k * width, int(count)] for k, count in enumerate(row)] for row in counts]
@@ -0,0 +1,88 @@
+import collections
+import sqlite3
+
+import pytest
+
+from src.batch import Checkpoint, run
+from src.funcs import indices
+
+SIZE = 10
+PAGE_SIZE = 4
+
+
+class StandIn:
+    # Pages of stand-in polygons and a scan that can be told to fail or be interrupted at one polygon
+    def __init__(self):
+        self.size = SIZE
+        self.listed = collections.Counter()
+        self.scanned = collections.Counter()
+        self.interrupt = None
+        self.fail = None
+
+    def sizer(self):
+        return self.size
+
+    def lister(self, after, page_size):
+        self.listed[after] += 1
+        ids = sorted(f"p{i:02d}" for i in range(self.size))
+        return [{'id': polygon, 'geometry': None} for polygon in ids if after is None or polygon > after][:page_size]
+
+    def scan(self, polygon, geometry, windows):
+        self.scanned[polygon] += 1
+        if polygon == self.interrupt:
+            raise KeyboardInterrupt
+        if polygon == self.fail:
+            raise RuntimeError("scan failed")
+        return [(polygon, "S0", "2020-05-15", index, 0.1, 0.1, 0.1) for index in indices]
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    return Checkpoint(str(tmp_path / "batch.sqlite"))
+
+
+def scan_all(checkpoint, stand_in, workers):
+    return run(checkpoint, workers=workers, page_size=PAGE_SIZE, windows=[[2020, 5]], lister=stand_in.lister,
+               scan=stand_in.scan, sizer=stand_in.sizer)
+
+
+def test_interrupted_run_resumes_without_redoing_work(checkpoint):
+    stand_in = StandIn()
+    stand_in.interrupt, stand_in.fail = "p06", "p02"
+    with pytest.raises(KeyboardInterrupt):
+        scan_all(checkpoint, stand_in, workers=1)
+    finished = set(stand_in.scanned) - {"p02", "p06"}
+    stand_in.scanned.clear()
+    stand_in.interrupt = stand_in.fail = None
+
+    progress = scan_all(checkpoint, stand_in, workers=2)
+
+    assert max(stand_in.listed.values()) == 1
+    assert not finished & set(stand_in.scanned)
+    assert {"p02", "p06"} <= set(stand_in.scanned)
+    assert progress.failed == 0
+    assert checkpoint.counts() == {'done': SIZE}
+    with sqlite3.connect(checkpoint.path) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM results").fetchone()[0] == SIZE * len(indices)
+
+
+def test_failed_polygon_is_given_up_after_max_attempts(checkpoint):
+    stand_in = StandIn()
+    stand_in.fail = "p03"
+    for _ in range(3):
+        run(checkpoint, page_size=PAGE_SIZE, max_attempts=2, windows=[[2020, 5]], lister=stand_in.lister,
+            scan=stand_in.scan, sizer=stand_in.sizer)
+    assert stand_in.scanned["p03"] == 2
+    assert checkpoint.counts() == {'done': SIZE - 1, 'failed': 1}
+
+
+def test_polygons_added_later_are_scanned(checkpoint):
+    stand_in = StandIn()
+    scan_all(checkpoint, stand_in, workers=2)
+    stand_in.scanned.clear()
+    stand_in.size = SIZE + 3
+
+    scan_all(checkpoint, stand_in, workers=2)
+
+    assert set(stand_in.scanned) == {f"p{i:02d}" for i in range(SIZE, SIZE + 3)}
+    assert checkpoint.counts() == {'done': SIZE + 3}
@@ -0,0 +1,47 @@
+from src.cache import MISSING, ResultCache
+
+
+def make_cache(tmp_path, **kwargs):
+    now = [0.0]
+    return ResultCache(str(tmp_path / "results.sqlite"), clock=lambda: now[0], **kwargs), now
+
+
+def test_expired_entries_are_not_served(tmp_path):
+    cache, now = make_cache(tmp_path, ttl=100)
+    cache.set("a", 1)
+    now[0] = 100
+    assert cache.get("a") == 1
+    now[0] = 101
+    assert cache.get("a") is MISSING
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    # Every value is 10 bytes of JSON, the fourth one pushes the total past 30
+    cache, now = make_cache(tmp_path, ttl=1000, max_bytes=30, evict_every=1)
+    for key in ("a", "b", "c"):
+        now[0] += 100
+        cache.set(key, "x" * 8)
+    now[0] += 100
+    cache.get("a")
+    now[0] += 100
+    cache.set("d", "x" * 8)
+    assert [key for key in "abcd" if cache.has(key)] == ["a", "c", "d"]
+
+
+def test_eviction_runs_every_few_writes(tmp_path):
+    cache, now = make_cache(tmp_path, ttl=1000, max_bytes=30, evict_every=3)
+    for key in ("a", "b", "c", "d"):
+        now[0] += 100
+        cache.set(key, "x" * 8)
+    assert cache.stats()["entries"] == 4
+    now[0] += 100
+    cache.set("e", "x" * 8)
+    cache.set("f", "x" * 8)
+    assert [key for key in "abcdef" if cache.has(key)] == ["d", "e", "f"]
+
+
+def test_computed_miss_counts_once(tmp_path):
+    cache, _ = make_cache(tmp_path)
+    assert cache.get_or_compute("e", lambda: 1) == 1
+    assert cache.get_or_compute("e", lambda: 2) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
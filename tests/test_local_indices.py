@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from src.local_indices import BANDS, INDICES, compute_indices
+
+
+def reference_indices(bands):
+    # Straight float64 transcription of the calculate_* expressions, one index at a time
+    b = {name: np.asarray(bands[name], dtype=np.float64) / 10000 for name in BANDS}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        reference = {
+            'NDVI': (b['B8'] - b['B4']) / (b['B8'] + b['B4']),
+            'NDWI1': (b['B8A'] - b['B12']) / (b['B8A'] + b['B12']),
+            'NDWI2': (b['B3'] - b['B8']) / (b['B8'] + b['B3']),
+            'NMDI': (b['B8A'] - (b['B11'] - b['B12'])) / (b['B8A'] + (b['B11'] - b['B12'])),
+            'EVI': 2.5 * (b['B8'] - b['B4']) / (b['B8'] + 6 * b['B4'] - 7.5 * b['B2'] + 1),
+            'MSI': b['B11'] / b['B8A'],
+            'MSAVI2': (2 * b['B8'] + 1 - np.sqrt((2 * b['B8'] + 1) ** 2 - 8 * (b['B8'] - b['B4']))) / 2,
+        }
+    return np.stack([np.where(np.isfinite(reference[index]), reference[index], np.nan) for index in INDICES])
+
+
+def synthetic_bands(shape=(512, 512), seed=0):
+    rng = np.random.default_rng(seed)
+    bands = {name: rng.integers(0, 10000, size=shape, dtype=np.uint16) for name in BANDS}
+    # A few zero pixels exercise the masked divisions
+    for name in BANDS:
+        bands[name][0, :4] = 0
+    return bands
+
+
+
+@pytest.fixture(scope="module")
+def indices():
+    bands = synthetic_bands()
+    return compute_indices(bands), reference_indices(bands)
+
+
+@pytest.mark.parametrize("position, index", list(enumerate(INDICES)))
+def test_matches_earth_engine_formulas(indices, position, index):
+    result, expected = indices[0][position], indices[1][position]
+    # Near-zero denominators blow up in any precision, only bounded reference values are compared
+    valid = np.abs(expected) <= 100
+    np.testing.assert_allclose(result[valid], expected[valid], rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("position, index", list(enumerate(INDICES)))
+def test_masked_pixels_are_nan(indices, position, index):
+    result, expected = indices[0][position], indices[1][position]
+    assert np.isnan(result[np.isnan(expected)]).all()
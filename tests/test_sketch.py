@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from src.sketch import HistogramSketch
+
+
+@pytest.fixture
+def values():
+    rng = np.random.default_rng(0)
+    return np.clip(rng.normal(0.2, 0.3, 100000), -1.5, 1.5)
+
+
+def test_merge_equals_one_sketch_of_all_values(values):
+    whole = HistogramSketch(-1, 1).update(values)
+    merged = HistogramSketch(-1, 1).update(values[:30000]).merge(HistogramSketch(-1, 1).update(values[30000:]))
+    np.testing.assert_array_equal(merged.counts, whole.counts)
+    assert merged.total == pytest.approx(whole.total)
+
+
+@pytest.mark.parametrize("q", [0.1, 0.25, 0.5, 0.75, 0.9])
+def test_quantile_within_error_bound(values, q):
+    sketch = HistogramSketch(-1, 1).update(values)
+    assert abs(sketch.quantile(q) - np.quantile(values, q)) <= sketch.error
+
+
+def test_mode_at_peak():
+    peak = np.random.default_rng(1).normal(0.5, 0.05, 100000)
+    sketch = HistogramSketch(-1, 1).update(peak)
+    assert abs(sketch.mode() - 0.5) <= 2 * sketch.error
+
+
+def test_exact_needed_only_outside_range(values):
+    assert not HistogramSketch(-1, 1).update(values).is_exact_needed()
+    assert HistogramSketch(-1, 1).update(values + 2).is_exact_needed()
+
+
+def test_merge_rejects_different_bins(values):
+    with pytest.raises(ValueError):
+        HistogramSketch(-1, 1).merge(HistogramSketch(-1, 1, bins=100))